@@ -0,0 +1,220 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import csv
+import json
+import time
+import pickle
+import shlex
+import socket
+import argparse
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+try:    # peak RSS is only reported where the resource module exists (not on Windows)
+    import resource
+except ImportError:
+    resource = None
+
+# Measures how fast stream.py emits batches, against a local TCP sink that reads and discards everything
+# Every case runs in a fresh process on synthetic datasets, so no real data is needed and peak RSS is per case
+# Run using python3 benchmark.py to sweep the default batch sizes and formats over every dataset path
+# Run using python3 benchmark.py -p cifar,csv -b 100,1000 -m max,rows:20000 --csv results.csv to pick the sweep
+# Run using python3 benchmark.py -p csv,text -c none,zlib,zstd to compare compression ratio against encode time per codec
+# Run using python3 benchmark.py --stream-args "--encode-workers 4 --queue-depth 8" to pass extra stream.py options
+parser = argparse.ArgumentParser(
+    description='Benchmarks stream.py against a local TCP sink')
+parser.add_argument('--paths', '-p', help='Comma separated dataset paths to benchmark: cifar, pokemon, csv, text',
+                    required=False, type=str, default='cifar,pokemon,csv,text')
+parser.add_argument('--batch-sizes', '-b', help='Comma separated batch sizes',
+                    required=False, type=str, default='100,1000')
+parser.add_argument('--formats', '-f', help='Comma separated wire formats',
+                    required=False, type=str, default='json,binary')
+parser.add_argument('--rate-modes', '-m', help='Comma separated pacing modes, with the rate after a colon where needed (max, rows:20000, batches:50)',
+                    required=False, type=str, default='max')
+parser.add_argument('--codecs', '-c', help='Comma separated --compress codecs, the compression ratio is reported next to the encode time',
+                    required=False, type=str, default='none')
+parser.add_argument('--stream-args', help='Extra stream.py arguments used for every case',
+                    required=False, type=str, default='')
+parser.add_argument('--rows', '-r', help='Rows in every synthetic dataset (split over the 5 CIFAR batch files)',
+                    required=False, type=int, default=10000)
+parser.add_argument('--data-dir', help='Directory for the synthetic datasets, a temporary directory by default',
+                    required=False, type=str, default=None)
+parser.add_argument('--csv', help='Write the results to this CSV file',
+                    required=False, type=str, default=None)
+parser.add_argument('--json', help='Write the results to this JSON file',
+                    required=False, type=str, default=None)
+
+CIFAR_FEATURES = 3072
+POKEMON_SHAPE = (32, 32, 3)
+CSV_FILE = 'synthetic/train.csv'
+TEXT_FILE = 'synthetic.txt'
+RESULT_FIELDS = ['path', 'batch_size', 'format', 'rate_mode', 'codec', 'batches', 'rows', 'bytes', 'raw_bytes',
+                 'compression_ratio', 'seconds',
+                 'rows_per_second', 'mb_per_second', 'encode_p50_ms', 'encode_p99_ms', 'send_p50_ms', 'send_p99_ms',
+                 'peak_rss_mb', 'error']
+
+
+def writeSyntheticDatasets(data_dir, rows, seed=0):    # write datasets shaped like the real ones under data_dir
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(data_dir, 'cifar'), exist_ok=True)
+    os.makedirs(os.path.join(data_dir, 'pokemon'), exist_ok=True)
+    os.makedirs(os.path.join(data_dir, 'synthetic'), exist_ok=True)
+    for file_index in range(1, 6):  # the five training batches of the cifar dataset
+        batch_data = {
+            b'data': rng.integers(0, 256, (max(1, rows // 5), CIFAR_FEATURES), dtype=np.uint8),
+            b'labels': rng.integers(0, 10, max(1, rows // 5)).tolist(),
+        }
+        with open(os.path.join(data_dir, 'cifar', f'data_batch_{file_index}'), 'wb') as batch_file:
+            pickle.dump(batch_data, batch_file)
+    batch_data = {  # the Pokemon pickles hold nested lists, which is what the JSON encoder gets
+        'img': rng.integers(0, 256, (rows, *POKEMON_SHAPE), dtype=np.uint8).tolist(),
+        'label': rng.integers(0, 151, rows).tolist(),
+    }
+    with open(os.path.join(data_dir, 'pokemon', 'train_batch_1.pickle'), 'wb') as batch_file:
+        pickle.dump(batch_data, batch_file)
+    pd.DataFrame({
+        'text': [f'synthetic message {row_index}' for row_index in range(rows)],
+        'category': rng.choice(['ham', 'spam', 'other'], rows),
+        'value': rng.normal(size=rows),
+        'label': rng.integers(0, 2, rows),
+    }).to_csv(os.path.join(data_dir, CSV_FILE), index=False)
+    with open(os.path.join(data_dir, TEXT_FILE), 'w') as text_file:
+        text_file.writelines(f'{row_index} synthetic log line {rng.integers(1 << 30)}\n' for row_index in range(rows))
+
+
+class Sink(threading.Thread):   # connects to the streamer and counts the bytes it receives until the stream closes
+    def __init__(self, port):
+        super().__init__(daemon=True)
+        self.connection = socket.create_connection(('localhost', port))
+        self.received = 0
+
+    def run(self):
+        while True:
+            chunk = self.connection.recv(1 << 20)
+            if not chunk:
+                break
+            self.received += len(chunk)
+        self.connection.close()
+
+
+def streamArgs(case, extra_args):
+    args = ['--batch-size', str(case['batch_size']), '--format', case['format']]
+    rate_mode, _, rate = case['rate_mode'].partition(':')
+    args += ['--rate-mode', rate_mode] + (['--rate', rate] if rate else [])
+    args += ['--compress', case['codec']]
+    return args + shlex.split(extra_args)
+
+
+def runCase(case, data_dir, extra_args):    # runs in its own process, returns one row of results
+    os.environ['TQDM_DISABLE'] = '1'
+    os.chdir(data_dir)
+    import stream
+    result = {field: case.get(field) for field in RESULT_FIELDS}
+    try:
+        stream.configure(stream.parser.parse_args(streamArgs(case, extra_args)))
+        server = socket.create_server(('localhost', 0))
+        sink = Sink(server.getsockname()[1])
+        connection, _ = server.accept()
+        server.close()
+        sink.start()
+        core = stream.StreamCore([connection], pacer=stream.pacer, compression=stream.compression,
+                                 compress_level=stream.compress_level, max_batch_bytes=stream.max_batch_bytes)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            if case['path'] == 'cifar':
+                stream.streamDataset(core, 'cifar')
+            elif case['path'] == 'pokemon':
+                stream.streamDataset(core, 'pokemon')
+            elif case['path'] == 'csv':
+                stream.streamCSVFile(core, CSV_FILE)
+            else:
+                stream.streamFile(core, TEXT_FILE)
+        core.close()
+        sink.join()
+        seconds = time.perf_counter() - started
+    except Exception as error_message:
+        result['error'] = f'{type(error_message).__name__}: {error_message}'
+        return result
+    history = list(core.history)
+    encode_ms = np.array([record['encode_seconds'] for record in history]) * 1000
+    send_ms = np.array([record['send_seconds'] for record in history]) * 1000
+    rows = sum(record['rows'] for record in history)
+    sent_bytes = sum(record['bytes'] for record in history)
+    raw_bytes = sum(record['raw_bytes'] or record['bytes'] for record in history)
+    result.update({
+        'batches': len(history),
+        'rows': rows,
+        'bytes': sink.received,
+        'raw_bytes': raw_bytes,
+        'compression_ratio': round(raw_bytes / sent_bytes, 3) if sent_bytes else None,    # size before / after compression
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds, 1),
+        'mb_per_second': round(sink.received / seconds / 2**20, 2),
+        'encode_p50_ms': round(float(np.percentile(encode_ms, 50)), 3) if len(history) else None,
+        'encode_p99_ms': round(float(np.percentile(encode_ms, 99)), 3) if len(history) else None,
+        'send_p50_ms': round(float(np.percentile(send_ms, 50)), 3) if len(history) else None,
+        'send_p99_ms': round(float(np.percentile(send_ms, 99)), 3) if len(history) else None,
+        'peak_rss_mb': peakRSS(),
+    })
+    return result
+
+
+def peakRSS():  # peak resident set size of this process in MB
+    # Linux keeps ru_maxrss across exec, so a spawned process would report its parent's peak, VmHWM starts fresh
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 2**10, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)    # bytes on macOS, KB elsewhere
+
+
+def runBenchmark(cases, data_dir, extra_args):
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(runCase, case, data_dir, extra_args).result()
+        print(json.dumps(result), flush=True)
+        results.append(result)
+    return results
+
+
+def writeResults(results, csv_file=None, json_file=None):
+    if csv_file:
+        with open(csv_file, 'w', newline='') as output:
+            writer = csv.DictWriter(output, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    if json_file:
+        with open(json_file, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    cases = [{'path': path, 'batch_size': int(batch_size), 'format': wire_format, 'rate_mode': rate_mode, 'codec': codec}
+             for path in args.paths.split(',')
+             for batch_size in args.batch_sizes.split(',')
+             for wire_format in args.formats.split(',')
+             for rate_mode in args.rate_modes.split(',')
+             for codec in args.codecs.split(',')]
+
+    with contextlib.ExitStack() as stack:
+        data_dir = args.data_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        print(f"Writing synthetic datasets to {data_dir}")
+        writeSyntheticDatasets(data_dir, args.rows)
+        results = runBenchmark(cases, os.path.abspath(data_dir), args.stream_args)
+    writeResults(results, args.csv, args.json)
@@ -0,0 +1,106 @@
+#! /usr/bin/python3
+
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from functools import partial
+import stream
+
+# Converts the files of stream.py datasets once into shards it memory-maps instead of unpickling or parsing every run:
+# image files become two .npy files (the uint8 images and the labels), CSV files an uncompressed Arrow IPC file
+# Every directory of shards has a manifest.json naming the shard of every source file with the size and modification
+# time the source had when it was converted, stream.py goes back to the source once it changed
+# Several streamers memory-mapping the same shards share a single copy of them in the page cache
+# Run using python3 convert.py -f cifar to convert the CIFAR batch files into converted/cifar
+# Run using python3 convert.py -f cifar,pokemon,spam -o /data/converted, then python3 stream.py --converted /data/converted
+parser = argparse.ArgumentParser(
+    description='Converts stream.py datasets into memory-mappable .npy and Arrow shards')
+parser.add_argument('--file', '-f', help='Comma separated registered datasets to convert (see stream.py --list-datasets)',
+                    required=False, type=str, default='cifar')
+parser.add_argument('--output', '-o', help='Directory to write the shards to, the --converted directory of stream.py',
+                    required=False, type=str, default='converted')
+parser.add_argument('--datasets', help='JSON file registering datasets, like stream.py --datasets',
+                    required=False, type=str, default=None)
+
+
+def replaceFile(path, write):   # write(file) to a temporary file next to path and move it in place, readers never see half a file
+    temporary_file = f'{path}.tmp'
+    with open(temporary_file, 'wb') as output:
+        write(output)
+    os.replace(temporary_file, path)
+
+
+def writeImageShard(read, input_file, shard_dir):   # the images and labels read from input_file as two .npy files
+    data, labels = read(input_file)
+    if not isinstance(data, np.ndarray):
+        raise ValueError(f"{input_file} holds images of different shapes, they can not be stored as one array")
+    name = os.path.basename(input_file)
+    files = {'data': f'{name}.data.npy', 'labels': f'{name}.labels.npy'}
+    replaceFile(os.path.join(shard_dir, files['data']), partial(np.save, arr=data, allow_pickle=False))
+    replaceFile(os.path.join(shard_dir, files['labels']), partial(np.save, arr=np.asarray(labels), allow_pickle=False))
+    return files, len(data)
+
+
+def writeTableShard(input_file, shard_dir):     # a CSV file as an Arrow IPC file, uncompressed so it can be memory-mapped
+    import pyarrow as pa
+    table = pa.Table.from_pandas(pd.read_csv(input_file), preserve_index=False)
+    files = {'table': f'{os.path.basename(input_file)}.arrow'}
+
+    def write(output):
+        with pa.ipc.new_file(output, table.schema) as writer:
+            writer.write_table(table)
+
+    replaceFile(os.path.join(shard_dir, files['table']), write)
+    return files, table.num_rows
+
+
+CONVERTERS = {  # dataset loader -> function writing the shard of one of its files, returning the shard files and rows
+    'loadCIFARFile': partial(writeImageShard, stream.readCIFARFile),
+    'loadPokemonFile': partial(writeImageShard, stream.readPokemonFile),
+    'loadCSVBatches': writeTableShard,
+}
+
+
+def updateManifest(shard_dir, name, shard):     # add or replace the shard of one source file in the manifest of shard_dir
+    manifest_file = os.path.join(shard_dir, stream.MANIFEST_FILE)
+    try:
+        with open(manifest_file) as existing:
+            manifest = json.load(existing)
+    except (OSError, ValueError):
+        manifest = {'shards': {}}
+    manifest['shards'][name] = shard
+    replaceFile(manifest_file, lambda output: output.write(json.dumps(manifest, indent=2).encode()))
+
+
+def convertDataset(name, output_dir):
+    dataset = stream.getDataset(name)
+    if dataset is None:
+        raise ValueError(f"{name} is not a registered dataset")
+    loader = dataset.loader if isinstance(dataset.loader, str) else dataset.loader.__name__
+    convert = CONVERTERS.get(loader)
+    if convert is None:
+        print(f"{name}: nothing to convert, {loader} does not parse its files")
+        return
+    for input_file in dataset.files:
+        shard_dir = os.path.join(output_dir, os.path.dirname(input_file))
+        os.makedirs(shard_dir, exist_ok=True)
+        stat = os.stat(input_file)  # before reading, a file changing while it is converted is read again by stream.py
+        files, rows = convert(input_file, shard_dir)
+        updateManifest(shard_dir, os.path.basename(input_file), {
+            'files': files,
+            'rows': rows,
+            'schema': dataset.schema,
+            'source_size': stat.st_size,
+            'source_mtime_ns': stat.st_mtime_ns,
+        })
+        print(f"{input_file}: {rows} rows -> {', '.join(os.path.join(shard_dir, shard_file) for shard_file in files.values())}")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.datasets or os.path.exists(stream.DATASETS_FILE):
+        stream.loadDatasets(args.datasets or stream.DATASETS_FILE)
+    for name in args.file.split(','):
+        convertDataset(name, args.output)
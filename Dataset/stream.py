@@ -1,17 +1,63 @@
 #! /usr/bin/python3
 
+import io
+import os
+import sys
+import mmap
 import time
 import json
+import zlib
+import base64
 import pickle
+import bisect
 import socket
+import queue
+import asyncio
+import inspect
 import argparse
+import importlib.util
+import threading
 import numpy as np
 import pandas as pd
+from functools import partial, reduce
+from itertools import islice
+from importlib.metadata import entry_points
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from tqdm.auto import tqdm
+from stream_reader import FRAME_MAGIC, FRAME_HEADER, KIND_NDARRAY, KIND_ARROW, KIND_TEXT, KIND_JSON, CODECS
 
 # Run using python3 stream.py to use CIFAR dataset and default batch_size as 100
 # Run using python3 stream.py -f <input_file> -b <batch_size> to use a custom file/dataset and batch size
 # Run using python3 stream.py -e True to stream endlessly in a loop
+# Run using python3 stream.py -s columnar to send image rows as one feature array instead of one key per feature
+# Run using python3 stream.py --format binary to send length-prefixed NumPy/Arrow batches (read them with stream_reader.py)
+# Run using python3 stream.py --rate-mode rows --rate 2000 to pace the stream at 2000 rows per second (see Pacer for all modes)
+# Run using python3 stream.py -f spam --chunked to read CSV datasets batch_size rows at a time instead of loading them whole
+# Run using python3 stream.py -f <input_file> --line-index-cache to keep the line offsets of a text file in <input_file>.lineidx.npy
+# Run using python3 stream.py --clients 3 --distribute hash --partition-key label to spread batches over 3 receivers by label
+# Run using python3 stream.py --encode-workers 4 --queue-depth 8 to encode up to 8 batches ahead in 4 processes
+# Run using python3 stream.py -e True --cache-mb 2048 to keep up to 2 GB of encoded batches for the following loops
+# Run using python3 stream.py --shards 5 --order throughput to load all 5 CIFAR batch files at once and interleave them
+# Run using python3 stream.py --resume to checkpoint every batch, wait for the receiver to come back when it drops and
+#   continue a stopped run from the last committed batch (add --ack if the receiver acknowledges every batch with a line,
+#   without it the batches still in flight when the receiver drops are lost)
+# Run using python3 stream.py --shuffle --seed 7 to send the rows in a seeded random order (see rowOrder and bufferShuffle)
+# Run using python3 stream.py --sample 0.1 --stratify label to send a seeded 10% of the rows of every label
+# Run using python3 stream.py -f spam --max-batch-bytes 65536 to split batches whose payload is larger than 64 KB
+# Run using python3 stream.py -f spam --chunked --window-ms 200 to send whatever rows were loaded every 200 ms
+# Run using python3 stream.py --ramp 10x20,100x20 -b 1000 to send 20 batches of 10 rows, 20 of 100, then batches of 1000
+# Run using python3 stream.py -f pokemon --resize 16x16 --quantize 4 --flatten to shrink every image before it is encoded
+# Run using python3 stream.py -f pokemon --image-encoding base64 to send the raw bytes of every image as base64 text
+# Run using python3 stream.py -f spam --compress zstd to send every batch as a compressed frame (read them with stream_reader.py)
+# Run using python3 stream.py --metrics-port 9100 to serve Prometheus metrics of the stream on http://localhost:9100/metrics
+# Run using python3 stream.py --event-log stream.events.jsonl to write one JSON line per batch sent and per reconnect
+# Run using python3 stream.py -f synthetic-csv --synthetic-rows 0 --rate-mode rows --rate 50000 --cardinality 100 to load-test
+#   with generated rows instead of a dataset on disk (also synthetic-cifar, synthetic-pokemon and synthetic-text)
+# Run using python3 convert.py -f cifar once, then python3 stream.py memory-maps the converted shards instead of unpickling
+# Run using python3 stream.py --list-datasets to print the registered datasets (see DATASETS), -f <name> streams one of them
+# Run using python3 stream.py --datasets my_datasets.json -f mydata to register datasets from a config file (see loadDatasets)
 parser = argparse.ArgumentParser(
     description='Streams a file to a Spark Streaming Context')
 parser.add_argument('--file', '-f', help='File to stream', required=False,
@@ -20,9 +66,1118 @@ parser.add_argument('--batch-size', '-b', help='Batch size',
                     required=False, type=int, default=100)  # default batch_size is 100
 parser.add_argument('--endless', '-e', help='Enable endless stream',
                     required=False, type=bool, default=False)  # looping disabled by default
+parser.add_argument('--schema', '-s', help='Payload schema for image batches: one key per feature or one feature array per row',
+                    required=False, type=str, default='features', choices=['features', 'columnar'])  # per-feature keys by default
+parser.add_argument('--format', help='Wire format: newline terminated JSON, or length-prefixed binary frames (NumPy for images, Arrow for CSV)',
+                    required=False, type=str, default='json', choices=['json', 'binary'])  # JSON by default
+parser.add_argument('--rate-mode', help='Pacing: fixed interval between batches, target rows/sec, target batches/sec, as fast as possible, or replay of a trace file',
+                    required=False, type=str, default='interval', choices=['interval', 'rows', 'batches', 'max', 'trace'])
+parser.add_argument('--interval', help='Seconds between batches for --rate-mode interval',
+                    required=False, type=float, default=5)  # one batch every 5 seconds by default
+parser.add_argument('--rate', help='Target rows/sec or batches/sec for --rate-mode rows/batches',
+                    required=False, type=float, default=None)
+parser.add_argument('--trace', help='File with one inter-arrival time in seconds per line for --rate-mode trace',
+                    required=False, type=str, default=None)
+parser.add_argument('--chunked', help='Read CSV files batch_size rows at a time, memory stays constant with respect to file size',
+                    required=False, action='store_true')  # CSV files are loaded whole by default
+parser.add_argument('--line-index-cache', help='Save the line offset index of newline delimited files next to them and reuse it on later runs',
+                    required=False, action='store_true')  # the index is only kept in memory by default
+parser.add_argument('--clients', help='Number of receivers to accept before streaming, batches are distributed between them',
+                    required=False, type=int, default=1)  # a single receiver by default
+parser.add_argument('--distribute', help='How batches are spread over several clients: round-robin, hash partitioning on --partition-key, or broadcast',
+                    required=False, type=str, default='roundrobin', choices=['roundrobin', 'hash', 'broadcast'])
+parser.add_argument('--partition-key', help='Column to hash for --distribute hash: a feature index, or label',
+                    required=False, type=str, default='label')
+parser.add_argument('--client-queue', help='Encoded batches queued per client before the streamer waits for that client',
+                    required=False, type=int, default=16)
+parser.add_argument('--encode-workers', help='Processes encoding batches ahead of the socket, 0 encodes in a single thread',
+                    required=False, type=int, default=0)
+parser.add_argument('--queue-depth', help='Number of batches loaded and encoded ahead of the batch being sent',
+                    required=False, type=int, default=1)
+parser.add_argument('--cache-mb', help='Megabytes of encoded batches kept between --endless loops (least recently used files are evicted), 0 disables the cache',
+                    required=False, type=float, default=512)
+parser.add_argument('--shards', help='Files of a dataset loaded concurrently, more than 1 also drops the pause between files',
+                    required=False, type=int, default=1)  # one file after the other by default
+parser.add_argument('--order', help='With --shards: keep the batches in file order, or send them as soon as any file has one ready',
+                    required=False, type=str, default='strict', choices=['strict', 'throughput'])
+parser.add_argument('--checkpoint', help='File recording the batches of every file that were delivered, updated after every batch',
+                    required=False, type=str, default=None)  # no checkpoint by default
+parser.add_argument('--resume', help='Continue from the --checkpoint file (stream.checkpoint.json by default) and wait for receivers that drop to reconnect, '
+                                     'batches in flight when a receiver drops are lost unless --ack is given',
+                    required=False, action='store_true')
+parser.add_argument('--ack', help='Only commit a batch once the receiver sent back one line for it, instead of once it was written',
+                    required=False, action='store_true')
+parser.add_argument('--max-batch-bytes', help='Largest payload sent as one batch, bigger batches are split into batches of fewer rows',
+                    required=False, type=int, default=None)  # no limit by default
+parser.add_argument('--window-ms', help='Time-window batching: send the rows loaded so far every this many milliseconds, even when there are fewer than batch_size',
+                    required=False, type=float, default=None)  # batches are only cut by size by default
+parser.add_argument('--ramp', help='Batch sizes to start every file with, as <rows>x<batches> steps separated by commas, --batch-size afterwards',
+                    required=False, type=str, default=None)
+parser.add_argument('--image-encoding', help='How Pokemon images are written in JSON batches: nested lists of values, or base64 of their raw bytes with their shape and dtype',
+                    required=False, type=str, default='list', choices=['list', 'base64'])  # nested lists by default
+parser.add_argument('--flatten', help='Send every Pokemon image as one flat row of values',
+                    required=False, action='store_true')
+parser.add_argument('--resize', help='Resize Pokemon images to <height>x<width> pixels (nearest neighbour)',
+                    required=False, type=str, default=None)
+parser.add_argument('--quantize', help='Keep the top bits of every uint8 Pokemon pixel value, values go from 0 to 2**bits-1',
+                    required=False, type=int, default=None, choices=range(1, 9))
+parser.add_argument('--shuffle', help='Send the rows in a random order: a permutation of the whole file, or a shuffle buffer of --shuffle-buffer rows for --chunked CSV files',
+                    required=False, action='store_true')  # rows are sent in file order by default
+parser.add_argument('--shuffle-buffer', help='Rows held by the shuffle buffer of streamed files',
+                    required=False, type=int, default=10000)
+parser.add_argument('--seed', help='Seed of --shuffle and --sample, the same seed sends the same rows in the same order',
+                    required=False, type=int, default=0)
+parser.add_argument('--sample', help='Fraction of the rows to send, picked at random',
+                    required=False, type=float, default=1)  # every row by default
+parser.add_argument('--stratify', help='With --sample: take the fraction from every value of this key separately (label, or a feature index)',
+                    required=False, type=str, default=None)
+parser.add_argument('--compress', help='Compress every batch with this codec and send it as a frame that names the codec, JSON batches included',
+                    required=False, type=str, default='none', choices=list(CODECS))  # uncompressed by default
+parser.add_argument('--compress-level', help='Compression level, the default of the codec when not given',
+                    required=False, type=int, default=None)
+parser.add_argument('--burst', help='Number of batches the pacer may send back to back after an idle period',
+                    required=False, type=float, default=1)
+parser.add_argument('--metrics-port', help='Serve counters and histograms of the stream in the Prometheus text format on this local port',
+                    required=False, type=int, default=None)  # no metrics endpoint by default
+parser.add_argument('--event-log', help='Append one JSON line with a wall clock timestamp per batch sent, run and reconnect to this file',
+                    required=False, type=str, default=None)  # no event log by default
+parser.add_argument('--synthetic-rows', help='Rows generated for every file of the synthetic-* datasets, 0 generates rows until the streamer is stopped',
+                    required=False, type=int, default=10000)
+parser.add_argument('--cardinality', help='Distinct labels of the synthetic-* datasets, and distinct values of their categorical columns and words',
+                    required=False, type=int, default=10)
+parser.add_argument('--synthetic-columns', help='Numeric and categorical columns of synthetic-csv rows, as <numeric>,<categorical>',
+                    required=False, type=str, default='8,2')
+parser.add_argument('--converted', help='Directory of the shards written by convert.py, files with an up to date shard there are memory-mapped instead of parsed, empty to always parse',
+                    required=False, type=str, default='converted')
+parser.add_argument('--datasets', help='JSON file registering datasets or changing the files of the built-in ones, datasets.json when it exists',
+                    required=False, type=str, default=None)
+parser.add_argument('--list-datasets', help='Print the registered datasets and exit',
+                    required=False, action='store_true')
 
 TCP_IP = "localhost"
 TCP_PORT = 6100
+CHECKPOINT_FILE = 'stream.checkpoint.json'    # default --checkpoint for --resume
+DATASETS_FILE = 'datasets.json'     # default --datasets, only read when it exists
+MANIFEST_FILE = 'manifest.json'     # lists the converted shards of a directory, see convert.py
+ENTRY_POINT_GROUP = 'stream.datasets'   # entry point group other packages register their datasets in
+
+
+class Pacer:
+    '''
+    Decides when the next batch may be sent. Waiting happens right before the send, so the time spent loading
+    and encoding a batch counts against the interval instead of adding to it.
+
+    interval: one batch every `interval` seconds
+    rows:     `rate` rows per second, a batch costs as many tokens as it has rows
+    batches:  `rate` batches per second
+    max:      no waiting, the stream goes as fast as the socket accepts
+    trace:    replays the inter-arrival times in `trace` (one number of seconds per line, looped when exhausted)
+
+    interval, rows and batches share a token bucket on the monotonic clock that holds `burst` batches at most.
+    '''
+
+    def __init__(self, mode='interval', interval=5, rate=None, trace=None, burst=1):
+        self.mode = mode
+        self.interval = interval
+        self.burst = burst
+        if mode == 'interval':
+            if not interval or interval <= 0:
+                raise ValueError("--interval must be positive for --rate-mode interval, use --rate-mode max to not wait")
+            self.rate = 1 / interval
+        elif mode in ('rows', 'batches'):
+            if not rate or rate <= 0:
+                raise ValueError(f"--rate must be positive for --rate-mode {mode}")
+            self.rate = rate
+        self.gaps = loadTrace(trace) if mode == 'trace' else None
+        self.gap_index = 0
+        self.tokens = None  # the bucket starts full, so the first batch goes out immediately
+        self.updated = time.monotonic()
+        self.next_send = None
+
+    def delay(self, rows):
+        # reserve the send slot of a batch of `rows` rows and return how many seconds to wait for it
+        if self.mode == 'max':
+            return 0
+        now = time.monotonic()
+        if self.mode == 'trace':
+            # being late does not build up a burst, the next gap starts from whichever is later
+            send_at = max(now, self.next_send or now)
+            self.next_send = send_at + self.gaps[self.gap_index % len(self.gaps)]
+            self.gap_index += 1
+            return send_at - now
+        cost = rows if self.mode == 'rows' else 1
+        capacity = max(cost, 1) * self.burst
+        if self.tokens is None:
+            self.tokens = capacity
+        else:
+            self.tokens = min(capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= cost     # a negative balance is the time still to wait
+        return max(0, -self.tokens) / self.rate
+
+    def wait(self, rows):  # block until a batch of `rows` rows may be sent
+        time.sleep(self.delay(rows))
+
+    def pause(self):    # pause between two files of a dataset, only the fixed interval mode keeps the old pause
+        if self.mode == 'interval':
+            time.sleep(self.interval)
+
+
+def loadTrace(trace_file):  # read the inter-arrival times of a recorded stream, blank lines and # comments are skipped
+    if trace_file is None:
+        raise ValueError("--trace is required for --rate-mode trace")
+    with open(trace_file, 'r') as file:
+        gaps = [float(line.split('#')[0]) for line in file if line.split('#')[0].strip()]
+    if not gaps or min(gaps) < 0:
+        raise ValueError(f"Trace file {trace_file} must contain non-negative inter-arrival times")
+    return gaps
+
+
+def listenTCP(backlog=1):   # the listening socket of connectTCP, kept open by --resume to accept receivers again
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((TCP_IP, TCP_PORT))
+    s.listen(backlog)
+    return s
+
+
+def acceptClients(client_count, s=None):    # like connectTCP, but waits for client_count receivers
+    s = s or listenTCP(client_count)
+    connections = []
+    for client_index in range(client_count):
+        print(f"Waiting for connection {client_index+1}/{client_count} on port {TCP_PORT}...")
+        connection, address = s.accept()
+        print(f"Connected to {address}")
+        connections.append(connection)
+    return connections
+
+
+# encode(*parts) returns the bytes to send, parts are the row aligned pieces of a batch,
+# source is the file it came from and index its position in that file (both are used by the checkpoint)
+Batch = namedtuple('Batch', ['encode', 'parts', 'source', 'index'], defaults=[None, None])
+# a batch that was encoded before, replayed from BatchCache: its payloads (more than one when --max-batch-bytes split it)
+EncodedBatch = namedtuple('EncodedBatch', ['send_batches', 'rows', 'source', 'index'], defaults=[None, None])
+HISTORY_SIZE = 100000   # per-batch records kept by StreamCore
+EVENT_FIELDS = ['source', 'index', 'rows', 'bytes', 'raw_bytes', 'encode_seconds', 'send_seconds', 'blocked_seconds']
+
+
+class ReceiverLost(ConnectionError):    # raised by StreamCore.stream when a receiver dropped and --resume waits for it
+    pass
+
+
+class Client:
+    '''
+    One receiver: an asyncio StreamWriter fed from its own bounded queue by a writer task.
+    write() followed by drain() never truncates a batch and waits while the receiver is behind,
+    a slow client only holds up its own queue. A client whose connection breaks is marked dead and skipped.
+
+    on_sent gets the time from write until drain and the part of it drain() waited for the socket (blocked).
+    A batch is acknowledged (on_acked) once it was written. With ack=True the receiver acknowledges instead:
+    it sends back one newline terminated line per batch, in the order it received them.
+    '''
+
+    def __init__(self, connection, queue_depth, ack=False):
+        self.connection = connection
+        self.address = connection.getpeername()
+        self.queue = asyncio.Queue(maxsize=queue_depth)
+        self.alive = True
+        self.ack = ack
+        self.unacked = deque()  # records of the batches written but not acknowledged yet, oldest first
+        self.writer = None
+        self.task = None
+        self.ack_task = None
+
+    async def start(self, on_sent, on_acked):
+        reader, self.writer = await asyncio.open_connection(sock=self.connection)
+        self.task = asyncio.create_task(self.run(on_sent, on_acked))
+        if self.ack:
+            self.ack_task = asyncio.create_task(self.readAcks(reader, on_acked))
+
+    async def run(self, on_sent, on_acked):
+        while True:
+            send_batch, record = await self.queue.get()
+            send_seconds = blocked_seconds = None
+            try:
+                if self.alive:
+                    if self.ack:    # before writing, the receiver may answer before drain() returns
+                        self.unacked.append(record)
+                    started = time.perf_counter()
+                    if isinstance(send_batch, list):    # header and zero-copy body
+                        self.writer.writelines(send_batch)
+                    else:
+                        self.writer.write(send_batch)  # send the payload to Spark
+                    drain_started = time.perf_counter()
+                    await self.writer.drain()   # only waits while the socket does not take more data
+                    send_seconds = time.perf_counter() - started
+                    blocked_seconds = time.perf_counter() - drain_started
+                    if not self.ack:
+                        on_acked(record)
+            except (ConnectionError, OSError) as error_message:
+                print(f"Either batch size is too big for the dataset or the connection was closed ({self.address}: {error_message})")
+                self.alive = False
+            finally:
+                on_sent(record, send_seconds, blocked_seconds)
+                self.queue.task_done()
+
+    async def readAcks(self, reader, on_acked):    # one line from the receiver acknowledges the oldest unacknowledged batch
+        try:
+            while True:
+                if not await reader.readline():
+                    raise ConnectionError("the receiver closed the connection")
+                if self.unacked:
+                    on_acked(self.unacked.popleft())
+        except (ConnectionError, OSError) as error_message:
+            if self.alive:
+                print(f"Connection was closed before every batch was acknowledged ({self.address}: {error_message})")
+            self.alive = False
+
+    async def settle(self):     # wait until every batch written so far was acknowledged, or the client is dead
+        while self.alive and self.unacked:
+            await asyncio.sleep(0.01)
+
+    async def close(self):
+        self.task.cancel()
+        if self.ack_task is not None:
+            self.ack_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+class BatchCache:
+    '''
+    In-memory cache of the encoded batches of whole files, so --endless loops after the first one skip loading
+    and encoding entirely. Entries are evicted least recently used first once they add up to more than max_bytes.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # key -> (list of EncodedBatch, size in bytes)
+        self.size = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, batches, size):
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        while self.entries and self.size + size > self.max_bytes:
+            self.size -= self.entries.popitem(last=False)[1][1]
+        self.entries[key] = (batches, size)
+        self.size += size
+
+
+class Checkpoint:
+    '''
+    Records how many batches of every file of a dataset were delivered, in a small JSON file rewritten after every batch:
+
+    {"dataset": "cifar", "settings": {"batch_size": 100, ...}, "files": {"cifar/data_batch_1": 100, "cifar/data_batch_2": 12}}
+
+    settings are the options deciding which rows go in which batch (see rowSettings), a checkpoint only resumes the same ones.
+
+    A file's offset only moves past batch i once batches 0 ... i were all acknowledged, so batches sent out of order
+    (several clients, --order throughput) are never skipped. With resume=True the offsets of an earlier run are loaded.
+    With ack=True on the clients (--ack) a batch is committed once the receiver confirmed it, the batches after the
+    offsets may be received twice (delivery is at least once). Without it a batch is committed once it was written, so
+    the batches still in the socket buffers when a receiver drops are lost (delivery is at most once for them).
+    '''
+
+    def __init__(self, checkpoint_file, dataset, settings, resume=False):
+        self.checkpoint_file = checkpoint_file
+        self.dataset = dataset
+        self.settings = settings
+        self.offsets = dict()   # input_file -> batches committed from the start of the file
+        self.acked = dict()     # input_file -> indices of acknowledged batches past the offset
+        if resume and os.path.exists(checkpoint_file):
+            self.load()
+
+    def load(self):
+        with open(self.checkpoint_file, 'r') as file:
+            checkpoint = json.load(file)
+        if checkpoint['dataset'] != self.dataset or checkpoint['settings'] != self.settings:
+            raise ValueError(f"Checkpoint {self.checkpoint_file} was written for {checkpoint['dataset']} with {checkpoint['settings']}, "
+                             f"remove it to stream {self.dataset} with {self.settings}")
+        self.offsets = checkpoint['files']
+        if self.offsets:
+            print(f"Resuming from {self.checkpoint_file}: {self.offsets}")
+
+    def offset(self, input_file):  # index of the first batch of input_file that still has to be sent
+        return self.offsets.get(input_file, 0)
+
+    def commit(self, input_file, index):
+        acked = self.acked.setdefault(input_file, set())
+        acked.add(index)
+        offset = self.offset(input_file)
+        if offset not in acked:
+            return
+        while offset in acked:
+            acked.remove(offset)
+            offset += 1
+        self.offsets[input_file] = offset
+        self.save()
+
+    def reset(self):    # the whole dataset was streamed, the next run starts over
+        self.offsets = dict()
+        self.acked = dict()
+        self.save()
+
+    def save(self):     # write a temporary file and rename it, so a crash never leaves a truncated checkpoint
+        with open(f'{self.checkpoint_file}.tmp', 'w') as file:
+            json.dump({'dataset': self.dataset, 'settings': self.settings, 'files': self.offsets}, file)
+        os.replace(f'{self.checkpoint_file}.tmp', self.checkpoint_file)
+
+
+class Metrics:
+    '''
+    Counters and histograms of a StreamCore, rendered in the Prometheus text format (serve() exposes them over HTTP).
+    Histograms are cumulative like Prometheus ones: every bucket counts the observations up to its upper bound.
+    '''
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+    COUNTERS = {
+        'stream_batches_sent_total': 'Batches written to every receiver they were routed to',
+        'stream_rows_sent_total': 'Rows of the batches sent',
+        'stream_bytes_sent_total': 'Bytes of the batches sent, after compression',
+        'stream_reconnects_total': 'Receivers that dropped and were replaced by a new connection',
+    }
+    HISTOGRAMS = {
+        'stream_encode_seconds': 'Time spent encoding a batch, 0 for batches replayed from the cache',
+        'stream_send_seconds': 'Time from write until drain of a batch, the slowest receiver for batches sent to several',
+        'stream_socket_blocked_seconds': 'Part of the send time drain() waited for a receiver socket to take more data',
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()    # the HTTP thread renders while the event loop updates
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.histograms = {name: {'buckets': [0] * (len(self.BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+                           for name in self.HISTOGRAMS}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms[name]
+            histogram['buckets'][bisect.bisect_left(self.BUCKETS, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, value in self.counters.items():
+                lines += [f'# HELP {name} {self.COUNTERS[name]}', f'# TYPE {name} counter', f'{name} {value}']
+            for name, histogram in self.histograms.items():
+                lines += [f'# HELP {name} {self.HISTOGRAMS[name]}', f'# TYPE {name} histogram']
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS + ('+Inf',), histogram['buckets']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines += [f'{name}_sum {histogram["sum"]}', f'{name}_count {histogram["count"]}']
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port):  # serve render() on http://localhost:<port>/metrics from a daemon thread, returns the server
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):   # keep scrapes out of the stream output
+                pass
+
+        server = ThreadingHTTPServer((TCP_IP, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{TCP_IP}:{port}/metrics")
+        return server
+
+
+class EventLog:
+    '''
+    Structured log of the stream, one JSON object per line with the wall clock `time` (seconds since the epoch, to line
+    up with the batch times Spark reports) and the `event`:
+
+    run:       files started, with the batch they start from
+    batch:     a batch was sent, with its source file, index, rows, bytes, raw_bytes and encode, send and blocked seconds
+    reconnect: receivers that dropped and the addresses that replaced them
+    '''
+
+    def __init__(self, event_file):
+        self.file = open(event_file, 'a', buffering=1)  # line buffered, every event is on disk once it is written
+
+    def write(self, event, **fields):
+        self.file.write(json.dumps({'time': time.time(), 'event': event, **fields}) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+def cacheKey(input_file, compression='none', compress_level=None, max_batch_bytes=None):
+    # the encoded bytes of a file only stay valid for the same file contents and encoding settings
+    stat = os.stat(input_file) if os.path.exists(input_file) else os.stat_result((0,) * 10)    # synthetic files do not exist
+    return (os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns, wire_format, payload_schema,
+            compression, compress_level, max_batch_bytes, image_encoding, tuple(sorted(image_options.items())),
+            json.dumps(rowSettings(), sort_keys=True))
+
+
+def rowSettings():  # the options deciding which rows of a file end up in which batch
+    return {'batch_size': batch_size, 'ramp': ramp_steps, 'window': batch_window, 'chunked': chunked_csv, 'shuffle': shuffle_rows, 'shuffle_buffer': shuffle_buffer,
+            'seed': seed, 'sample': sample_fraction, 'stratify': stratify_key,
+            'synthetic': [synthetic_rows, cardinality, synthetic_columns]}
+
+
+class StreamCore:
+    '''
+    asyncio core of the streamer, shared by every dataset function.
+    run() takes an iterator of Batch tuples. A loader thread pulls the next batches from the iterator and up to
+    `encode_queue` of them are encoded ahead of the batch being sent, in a single thread or in a pool of
+    `encode_workers` processes. Batches are still sent in order, and the event loop itself only paces and writes.
+
+    With several clients, batches are distributed by `mode`:
+    roundrobin: each batch goes to the next live client, clients with a full queue are skipped while another one has room
+    hash:       the rows of every batch are split by the hash of partition_key, so equal keys always reach the same client
+    broadcast:  every client receives every batch
+
+    Every batch is recorded in `history` with its rows, bytes, encode time and send latency
+    (write until drain, the slowest client for batches sent to several clients).
+    The event loop lives as long as the core, so connections stay open between runs.
+    runFile() also keeps the encoded batches of every file in `cache` (a BatchCache) and replays them from there,
+    except in hash mode where the rows of a batch are split differently for every client.
+
+    Every acknowledged batch is committed to `checkpoint` (a Checkpoint) and runFile() starts files at their offset.
+    With a listening socket `server`, a client that drops is replaced by the next connection on it and the files
+    being streamed continue from their checkpoint offset. Without one, run() raises ConnectionError once every client dropped.
+
+    Sent batches and reconnects are also counted in `metrics` (a Metrics) and written to `events` (an EventLog).
+
+    Batches are sent when `pacer` (a Pacer, no waiting by default) allows, compressed with `compression` at
+    `compress_level` and split when their payload is larger than `max_batch_bytes` (see encodePieces).
+    '''
+
+    def __init__(self, connections, mode='roundrobin', partition_key='label', queue_depth=16,
+                 encode_workers=0, encode_queue=1, cache=None, checkpoint=None, ack=False, server=None,
+                 metrics=None, events=None, pacer=None, compression='none', compress_level=None, max_batch_bytes=None):
+        self.loop = asyncio.new_event_loop()
+        self.loader = ThreadPoolExecutor(max_workers=1)
+        if encode_workers > 0:
+            self.encoder = ProcessPoolExecutor(max_workers=encode_workers)
+        else:
+            self.encoder = ThreadPoolExecutor(max_workers=1)
+        self.encode_queue = max(1, encode_queue)
+        self.queue_depth = queue_depth
+        self.ack = ack
+        self.clients = [Client(connection, queue_depth, ack) for connection in connections]
+        self.mode = mode
+        self.partition_key = partition_key if partition_key == 'label' else int(partition_key)
+        self.next_client = 0
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.progress = None
+        self.cache = cache if mode != 'hash' else None
+        self.recordings = dict()    # input_file -> (encoded batches, bytes) of the files being streamed, for the cache
+        self.checkpoint = checkpoint
+        self.server = server
+        self.metrics = metrics
+        self.events = events
+        self.pacer = pacer if pacer is not None else Pacer('max')
+        self.compression = compression
+        self.compress_level = compress_level
+        self.max_batch_bytes = max_batch_bytes
+        self.loop.run_until_complete(self.start(self.clients))
+
+    async def start(self, clients):
+        await asyncio.gather(*(client.start(self.sent, self.acked) for client in clients))
+
+    def run(self, batches, total=None):     # stream every batch of the iterator and return once all were written
+        batches = iter(batches)
+        try:
+            with tqdm(total=total) as self.progress:
+                self.loop.run_until_complete(self.stream(batches))
+        finally:
+            self.progress = None
+            if hasattr(batches, 'close'):   # stops the loader threads of shardedBatches
+                batches.close()
+
+    def reconnect(self):    # replace the clients that dropped with new connections on the listening socket
+        dead = [client for client in self.clients if not client.alive]
+        print(f"{len(dead)} receiver(s) dropped, resuming from the last committed batches once they reconnect")
+        self.loop.run_until_complete(self.stop(dead))
+        connections = iter(acceptClients(len(dead), self.server))
+        self.clients = [client if client.alive else Client(next(connections), self.queue_depth, self.ack)
+                        for client in self.clients]
+        added = [client for client in self.clients if client.writer is None]
+        self.loop.run_until_complete(self.start(added))
+        if self.metrics is not None:
+            self.metrics.inc('stream_reconnects_total', len(dead))
+        if self.events is not None:
+            self.events.write('reconnect', dropped=['%s:%s' % client.address[:2] for client in dead],
+                              connected=['%s:%s' % client.address[:2] for client in added])
+
+    def runFile(self, input_file, load, *args):
+        '''
+        Streams the batches of input_file returned by load(*args) (a generator and the number of batches).
+        When the file is in the cache its encoded batches are replayed without calling load at all.
+        '''
+        self.runFiles([(input_file, load, args)])
+
+    def cacheKey(self, input_file):     # cacheKey of a file encoded with the codec settings of this core
+        return cacheKey(input_file, self.compression, self.compress_level, self.max_batch_bytes)
+
+    def runFiles(self, files, shards=1, order='strict'):
+        '''
+        Streams several files given as (input_file, load, args) tuples, loading up to `shards` of them at once
+        (see shardedBatches for the order the batches are sent in). Cached files are replayed from the cache.
+        '''
+        try:
+            while True:
+                sources = []
+                for input_file, load, args in files:
+                    start = self.checkpoint.offset(input_file) if self.checkpoint is not None else 0
+                    cached = self.cache.get(self.cacheKey(input_file)) if self.cache is not None else None
+                    if cached is not None:
+                        sources.append((cached[start:], len(cached) - start))
+                    else:
+                        if self.cache is not None and start == 0:   # only whole files are cached
+                            self.recordings[input_file] = ([], 0)
+                        sources.append((partial(loadSource, input_file, load, args, start), None))
+                totals = [total for _, total in sources]
+                if self.events is not None:
+                    self.events.write('run', files=[input_file for input_file, _, _ in files],
+                                      start=[self.checkpoint.offset(input_file) if self.checkpoint is not None else 0
+                                             for input_file, _, _ in files])
+                try:
+                    self.run(shardedBatches([batches for batches, _ in sources], shards, order),
+                             total=sum(totals) if None not in totals else None)
+                    break
+                except ReceiverLost:
+                    self.recordings = dict()
+                    self.reconnect()
+            for input_file, (batches, size) in self.recordings.items():
+                if batches is not None:
+                    self.cache.put(self.cacheKey(input_file), batches, size)
+        finally:
+            self.recordings = dict()
+
+    async def stream(self, batches):
+        encoding = deque()  # encode tasks of the upcoming batches, in stream order
+        exhausted = False
+        try:
+            while True:
+                # keep encode_queue batches encoding behind the one about to be sent
+                while not exhausted and len(encoding) <= self.encode_queue:
+                    batch = await self.loop.run_in_executor(self.loader, next, batches, None)
+                    if batch is None:
+                        exhausted = True
+                    else:
+                        encoding.append(asyncio.ensure_future(self.encode(batch)))
+                if not encoding:
+                    break
+                record, routed = await encoding.popleft()
+                self.record(record, routed)
+                self.checkReceivers()
+                if not any(client.alive for client in self.clients):    # nobody is left to send the rest to
+                    raise ConnectionError("every receiver dropped")
+                await self.dispatch(record, routed)
+            await asyncio.gather(*(client.queue.join() for client in self.clients))
+            await asyncio.gather(*(client.settle() for client in self.clients))
+            self.checkReceivers()
+        finally:
+            for task in encoding:
+                task.cancel()
+
+    def checkReceivers(self):   # with a listening socket, stop streaming as soon as a client dropped
+        if self.server is not None and not all(client.alive for client in self.clients):
+            raise ReceiverLost("a receiver dropped")
+
+    def record(self, record, routed):   # keep the encoded batch for the cache, give up once the file does not fit
+        batches, size = self.recordings.get(record.get('source'), (None, 0))
+        if batches is None:
+            return
+        size += record['bytes']
+        if size > self.cache.max_bytes:
+            self.recordings[record['source']] = (None, size)
+        else:
+            batches.append(EncodedBatch([send_batch for _, send_batch in routed], record['rows'], record['source'], record['index']))
+            self.recordings[record['source']] = (batches, size)
+
+    async def encode(self, batch):  # encode every routed piece of a batch in the encoder pool
+        if isinstance(batch, EncodedBatch):
+            record = {'rows': batch.rows, 'bytes': sum(payloadSize(send_batch) for send_batch in batch.send_batches),
+                      'raw_bytes': None, 'encode_seconds': 0.0, 'send_seconds': 0.0, 'blocked_seconds': 0.0,
+                      'source': batch.source, 'index': batch.index}
+            return record, [(self.clients if self.mode == 'broadcast' else None, send_batch) for send_batch in batch.send_batches]
+        routes = self.route(batch)
+        encoded = await asyncio.gather(*(asyncio.wrap_future(self.encoder.submit(timedEncode, batch.encode, parts,
+                                                                                 self.compression, self.compress_level,
+                                                                                 self.max_batch_bytes))
+                                         for _, parts in routes))
+        record = {
+            'rows': len(batch.parts[0]),
+            'bytes': sum(payloadSize(send_batch) for send_batches, _, _ in encoded for send_batch in send_batches),
+            'raw_bytes': sum(raw_bytes for _, _, raw_bytes in encoded),    # before compression
+            'encode_seconds': sum(encode_seconds for _, encode_seconds, _ in encoded),
+            'send_seconds': 0.0,
+            'blocked_seconds': 0.0,
+            'source': batch.source,
+            'index': batch.index,
+        }
+        # every payload is sent on its own, pieces of a split batch without clients may go to different clients
+        return record, [(clients, send_batch) for (clients, _), (send_batches, _, _) in zip(routes, encoded)
+                        for send_batch in send_batches]
+
+    def route(self, batch):
+        # split a batch into (clients, parts) pieces to encode, clients=None picks the next client at send time
+        if self.mode == 'broadcast':
+            return [(self.clients, batch.parts)]
+        if self.mode == 'hash' and len(self.clients) > 1:
+            keys = np.asarray(partitionKeys(batch.parts, self.partition_key), dtype=object)
+            client_indices = pd.util.hash_array(keys) % len(self.clients)
+            return [([self.clients[client_index]], [takeRows(part, row_indices) for part in batch.parts])
+                    for client_index in range(len(self.clients))
+                    for row_indices in [np.flatnonzero(client_indices == client_index)] if len(row_indices)]
+        return [(None, batch.parts)]
+
+    async def dispatch(self, record, routed):
+        await asyncio.sleep(self.pacer.delay(record['rows']))
+        routed = [(clients or [self.nextClient()], send_batch) for clients, send_batch in routed]
+        record['pending'] = record['unacked'] = sum(len(clients) for clients, _ in routed)
+        for clients, send_batch in routed:
+            for client in clients:
+                await client.queue.put((send_batch, record))
+
+    def nextClient(self):
+        live_clients = [client for client in self.clients if client.alive] or self.clients
+        for offset in range(len(live_clients)):
+            client = live_clients[(self.next_client + offset) % len(live_clients)]
+            if not client.queue.full():
+                break
+        else:   # every queue is full, wait for the client whose turn it is
+            client = live_clients[self.next_client % len(live_clients)]
+        self.next_client = (live_clients.index(client) + 1) % len(live_clients)
+        return client
+
+    def sent(self, record, send_seconds, blocked_seconds):
+        # called by the clients once they wrote (or dropped) their part of a batch, times are the slowest client's
+        record['send_seconds'] = max(record['send_seconds'], send_seconds or 0.0)
+        record['blocked_seconds'] = max(record['blocked_seconds'], blocked_seconds or 0.0)
+        record['pending'] -= 1
+        if record['pending']:
+            return
+        del record['pending']
+        self.history.append(record)
+        if self.metrics is not None:
+            self.metrics.inc('stream_batches_sent_total')
+            self.metrics.inc('stream_rows_sent_total', record['rows'])
+            self.metrics.inc('stream_bytes_sent_total', record['bytes'])
+            self.metrics.observe('stream_encode_seconds', record['encode_seconds'])
+            self.metrics.observe('stream_send_seconds', record['send_seconds'])
+            self.metrics.observe('stream_socket_blocked_seconds', record['blocked_seconds'])
+        if self.events is not None:
+            self.events.write('batch', **{field: record[field] for field in EVENT_FIELDS})
+        if self.progress is not None:
+            self.progress.update(1)
+            self.progress.set_postfix(kb=f"{record['bytes']/1024:.0f}", send_ms=f"{record['send_seconds']*1000:.1f}", refresh=False)
+
+    def acked(self, record):    # called once a client's part of a batch was acknowledged, commits whole batches
+        record['unacked'] -= 1
+        if record['unacked']:
+            return
+        del record['unacked']
+        if self.checkpoint is not None and record['source'] is not None:
+            self.checkpoint.commit(record['source'], record['index'])
+
+    def close(self):
+        self.loop.run_until_complete(self.stop(self.clients))
+        self.loader.shutdown()
+        self.encoder.shutdown()
+        self.loop.close()
+
+    async def stop(self, clients):
+        await asyncio.gather(*(client.close() for client in clients))
+
+
+def loadSource(input_file, load, args, start=0):
+    # load a file and tag its batches with the file they came from and their index, skipping the first `start` batches
+    batches, _ = load(*args)
+    if batch_window is not None:
+        batches = windowBatches(batches, batch_window)
+    return (batch._replace(source=input_file, index=index) for index, batch in islice(enumerate(batches), start, None))
+
+
+def shardedBatches(sources, shards=1, order='strict'):
+    '''
+    Yields the batches of several sources, each either a list of batches or a function loading them.
+    Up to `shards` sources are loaded at once in background threads:
+    strict:     batches are yielded in file order, the following files are loaded while the current one is sent
+    throughput: batches are yielded as soon as any loaded file has one ready, files are interleaved
+    '''
+    def openSource(source):
+        return iter(source) if not callable(source) else source()
+
+    if shards <= 1 or len(sources) <= 1:
+        for source in sources:
+            yield from openSource(source)
+        return
+    if order == 'strict':
+        with ThreadPoolExecutor(max_workers=shards) as loader:
+            loading = deque(loader.submit(openSource, source) for source in sources[:shards])
+            next_source = shards
+            try:
+                while loading:
+                    batches = loading.popleft().result()
+                    if next_source < len(sources):
+                        loading.append(loader.submit(openSource, sources[next_source]))
+                        next_source += 1
+                    yield from batches
+            finally:
+                for future in loading:
+                    future.cancel()
+        return
+    # throughput: every shard thread streams whole files into one bounded queue
+    ready = queue.Queue(maxsize=4 * shards)
+    pending = queue.Queue()
+    for source in sources:
+        pending.put(source)
+    stopped = threading.Event()
+
+    def shard():
+        while not stopped.is_set():
+            try:
+                source = pending.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                for batch in openSource(source):
+                    while not stopped.is_set():
+                        try:
+                            ready.put(batch, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+            except Exception as error_message:
+                ready.put(error_message)
+        ready.put(None)     # this shard is done
+
+    for _ in range(shards):
+        threading.Thread(target=shard, daemon=True).start()
+    running = shards
+    try:
+        while running:
+            batch = ready.get()
+            if batch is None:
+                running -= 1
+            elif isinstance(batch, Exception):
+                raise batch
+            else:
+                yield batch
+    finally:
+        stopped.set()
+
+
+def timedEncode(encode, parts, codec='none', level=None, max_bytes=None):
+    # runs in the encoder pool, returns the encoded (and compressed) payloads of a batch, the seconds it took
+    # and their size before compression
+    started = time.perf_counter()
+    send_batches, raw_bytes = encodePieces(encode, parts, codec, level, max_bytes)
+    return send_batches, time.perf_counter() - started, raw_bytes
+
+
+def encodePieces(encode, parts, codec='none', level=None, max_bytes=None):
+    '''
+    Encodes a batch as one payload, or as several when the payload is larger than max_bytes: the rows are then split
+    into as many equal slices as the size calls for, and slices that are still too big are split again.
+    A single row is always sent whole, even when it is larger than max_bytes.
+    '''
+    send_batch = encode(*parts)
+    raw_bytes = payloadSize(send_batch)
+    if codec != 'none':
+        send_batch = compressBatch(send_batch, codec, level)
+    row_count = len(parts[0])
+    if max_bytes is None or row_count <= 1 or payloadSize(send_batch) <= max_bytes:
+        return [send_batch], raw_bytes
+    send_batches, raw_bytes = [], 0
+    bounds = np.linspace(0, row_count, min(row_count, -(-payloadSize(send_batch) // max_bytes)) + 1).astype(int)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        piece_batches, piece_bytes = encodePieces(encode, [sliceRows(part, start, stop) for part in parts],
+                                                  codec, level, max_bytes)
+        send_batches += piece_batches
+        raw_bytes += piece_bytes
+    return send_batches, raw_bytes
+
+
+def compressBatch(send_batch, codec, level=None):
+    # binary frames are compressed behind a new header with the codec added to their kind, JSON payloads become KIND_JSON frames
+    if isinstance(send_batch, list):    # header and zero-copy body
+        kind, payload = FRAME_HEADER.unpack(send_batch[0])[1], send_batch[1]
+    elif send_batch[:len(FRAME_MAGIC)] == FRAME_MAGIC:
+        kind, payload = send_batch[len(FRAME_MAGIC)], memoryview(send_batch)[FRAME_HEADER.size:]
+    else:
+        kind, payload = KIND_JSON, send_batch
+    payload = compressPayload(payload, codec, level)
+    return [FRAME_HEADER.pack(FRAME_MAGIC, kind | CODECS[codec] << 4, len(payload)), payload]
+
+
+def compressPayload(payload, codec, level=None):
+    if codec == 'zlib':
+        return zlib.compress(payload, -1 if level is None else level)
+    if codec == 'lz4':
+        import lz4.frame    # only needed for --compress lz4
+        return lz4.frame.compress(payload, compression_level=level or 0)
+    if codec == 'zstd':
+        import zstandard    # only needed for --compress zstd
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(payload)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def payloadSize(send_batch):
+    if isinstance(send_batch, list):
+        return sum(len(buffer) for buffer in send_batch)
+    return len(send_batch)
+
+
+def partitionKeys(parts, partition_key):    # the value of the partition key for every row of a batch
+    data = parts[0]
+    if isinstance(data, LineBatch):     # newline delimited files are partitioned on the whole line
+        return [bytes(data.line(row_index)) for row_index in range(len(data))]
+    if partition_key == 'label':
+        if len(parts) < 2:
+            raise ValueError("This dataset has no labels, use a feature index as --partition-key or --stratify")
+        return list(parts[-1])
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[:, partition_key].tolist()
+    if isinstance(data, np.ndarray):
+        return data.reshape(len(data), -1)[:, partition_key].tolist()
+    return [np.asarray(row).ravel()[partition_key].item() for row in data]
+
+
+def takeRows(part, row_indices):    # select rows of a batch part, whatever container it is stored in
+    if isinstance(part, np.ndarray):
+        return part[row_indices]
+    if isinstance(part, pd.DataFrame):
+        return part.iloc[row_indices]
+    if isinstance(part, (LineBatch, LineIndex)):
+        return part.take(row_indices)
+    return [part[row_index] for row_index in row_indices]
+
+
+def sliceRows(part, start, stop):   # rows [start, stop) of a batch part, a view where the container allows it
+    if isinstance(part, pd.DataFrame):
+        return part.iloc[start:stop]
+    if isinstance(part, (LineIndex, LineBatch)):
+        return part.batch(start, stop)
+    return part[start:stop]
+
+
+def concatRows(part, other):    # the rows of two parts of the same container type, one after the other
+    if isinstance(part, pd.DataFrame):
+        return pd.concat([part, other])
+    if isinstance(part, np.ndarray):
+        return np.concatenate([part, other])
+    if isinstance(part, LineBatch):
+        return LineBatch(memoryview(bytes(part.view) + bytes(other.view)),
+                         np.concatenate((part.offsets, other.offsets[1:] + part.offsets[-1])))
+    return list(part) + list(other)
+
+
+def batchSizes():
+    # rows of every batch of a file: the --ramp steps first, then batch_size for as long as the file lasts
+    for rows, batches in ramp_steps:
+        for _ in range(batches):
+            yield rows
+    while True:
+        yield batch_size
+
+
+def batchBounds(row_count):     # (start, stop) rows of every batch of a file of row_count rows, the last one may be partial
+    bounds = []
+    start = 0
+    for rows in batchSizes():
+        if start >= row_count:
+            break
+        bounds.append((start, min(start + rows, row_count)))
+        start += rows
+    return bounds
+
+
+def batchRows(encode, parts, row_order=None):
+    '''
+    Returns a generator of the batches of row aligned parts and their number. Without row_order the batches are
+    consecutive slices (views on NumPy arrays and memory maps), otherwise every batch takes the next rows of
+    row_order, so only one batch is ever gathered in memory. Batch sizes follow batchSizes and every row is sent once.
+    '''
+    if row_order is None:
+        bounds = batchBounds(len(parts[0]))
+        return (Batch(encode, tuple(sliceRows(part, start, stop) for part in parts)) for start, stop in bounds), len(bounds)
+    bounds = batchBounds(len(row_order))
+    return (Batch(encode, tuple(takeRows(part, row_order[start:stop]) for part in parts)) for start, stop in bounds), len(bounds)
+
+
+def windowBatches(batches, window):
+    '''
+    Time-window batching: a loader thread collects the rows of `batches` and every `window` seconds the rows collected
+    since the last flush are sent as one batch, however few they are. As soon as batch_size rows are ready they are sent
+    without waiting for the window, and a window without any new rows sends nothing.
+    '''
+    ready = queue.Queue(maxsize=4)
+    stopped = threading.Event()
+
+    def load():
+        try:
+            for batch in batches:
+                while not stopped.is_set():
+                    try:
+                        ready.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+            ready.put(None)
+        except Exception as error_message:
+            ready.put(error_message)
+
+    threading.Thread(target=load, daemon=True).start()
+    pending = None  # the parts of the rows collected so far
+    encode = None   # the encoder of the batches they came from, bound together with pending
+    deadline = time.monotonic() + window
+    try:
+        while True:
+            try:
+                batch = ready.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:     # the window is over, flush what there is
+                if pending is not None:
+                    yield Batch(encode, tuple(pending))
+                    pending, encode = None, None
+                deadline = max(deadline + window, time.monotonic())
+                continue
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            if pending is None:
+                pending, encode = list(batch.parts), batch.encode
+            else:
+                pending = [concatRows(*part) for part in zip(pending, batch.parts)]
+            while pending is not None and len(pending[0]) >= batch_size:
+                yield Batch(encode, tuple(sliceRows(part, 0, batch_size) for part in pending))
+                rest = len(pending[0]) - batch_size
+                if rest:
+                    pending = [sliceRows(part, batch_size, batch_size + rest) for part in pending]
+                else:
+                    pending, encode = None, None
+        if pending is not None:
+            yield Batch(encode, tuple(pending))
+    finally:
+        stopped.set()
+
+
+def shuffleRNG(input_file):     # random generator of a file, seeded with --seed and the file name
+    return np.random.default_rng([seed, zlib.crc32(input_file.encode())])
+
+
+def rowOrder(input_file, parts):
+    '''
+    Indices of the rows of an in-memory file to stream, in the order to stream them, or None to stream every row in file order.
+    --sample keeps a random fraction of the rows (of the rows of every --stratify key) and --shuffle permutes them.
+    The order only depends on --seed and the file name, so every --endless loop and resumed run sends the same batches.
+    '''
+    if sample_fraction >= 1 and not shuffle_rows:
+        return None
+    rng = shuffleRNG(input_file)
+    row_order = sampleRows(parts, rng) if sample_fraction < 1 else np.arange(len(parts[0]))
+    return rng.permutation(row_order) if shuffle_rows else row_order
+
+
+def sampleRows(parts, rng):     # sorted indices of a random sample_fraction of the rows, taken per key with --stratify
+    if stratify_key is None:
+        strata = [np.arange(len(parts[0]))]
+    elif isinstance(parts[0], LineIndex):
+        raise ValueError("Newline delimited files have no columns to --stratify on")
+    else:
+        codes = pd.factorize(np.asarray(partitionKeys(parts, stratify_key), dtype=object), use_na_sentinel=False)[0]
+        strata = np.split(np.argsort(codes, kind='stable'), np.cumsum(np.bincount(codes))[:-1])
+    # stochastic rounding keeps the expected sample size exact, even for strata smaller than 1/sample_fraction rows
+    kept = [rng.choice(stratum, int(len(stratum) * sample_fraction + rng.random()), replace=False) for stratum in strata]
+    return np.sort(np.concatenate(kept))
+
+
+def bufferShuffle(batches, rng):
+    '''
+    Shuffles a stream of batches that is never held in memory as a whole, through a buffer of --shuffle-buffer row slots:
+    once the buffer is full every incoming row takes the slot of a random buffered row, which is sent on in the next batch.
+    Slots only hold where their row is, the rows stay in the batch they arrived in until a batch of batch_size rows
+    gathers them, so every row is copied once on its way out instead of with the whole buffer for every batch.
+    A row can move up to the buffer size away from its position in the file. Memory holds the incoming batches that
+    still have a row in the buffer, a few buffer sizes of rows, never the whole stream.
+    '''
+    buffer_size = max(shuffle_buffer, 0)
+    held = dict()   # number of an incoming batch -> its parts and how many of its rows were not sent yet
+    slot_batches = np.empty(buffer_size, dtype=np.int64)    # which incoming batch and row every slot holds
+    slot_rows = np.empty(buffer_size, dtype=np.int64)
+    filled = 0
+    sent = []   # (incoming batch, row) of the rows of the next batch, in the order they left the buffer
+    sizes = batchSizes()
+    rows = next(sizes)
+    for batch_number, batch in enumerate(batches):
+        encode = batch.encode
+        row_count = len(batch.parts[0])
+        if row_count == 0:
+            continue
+        held[batch_number] = [batch.parts, row_count]
+        fill = min(row_count, buffer_size - filled)
+        slot_batches[filled:filled+fill] = batch_number
+        slot_rows[filled:filled+fill] = np.arange(fill)
+        filled += fill
+        for row_index, slot in zip(range(fill, row_count), rng.integers(0, max(buffer_size, 1), row_count - fill)):
+            if buffer_size:
+                sent.append((slot_batches[slot], slot_rows[slot]))
+                slot_batches[slot], slot_rows[slot] = batch_number, row_index
+            else:   # no buffer, rows go out in file order
+                sent.append((batch_number, row_index))
+            if len(sent) == rows:
+                yield Batch(encode, gatherRows(held, sent))
+                sent = []
+                rows = next(sizes)
+    for slot in rng.permutation(filled):    # the end of the stream, send what the buffer holds in a random order
+        sent.append((slot_batches[slot], slot_rows[slot]))
+        if len(sent) == rows:
+            yield Batch(encode, gatherRows(held, sent))
+            sent = []
+            rows = next(sizes)
+    if sent:
+        yield Batch(encode, gatherRows(held, sent))
+
+
+def gatherRows(held, sent):
+    # the parts of a batch holding the `sent` (incoming batch, row) rows in that order, from the incoming batches in
+    # `held`, which are dropped once all of their rows were sent
+    batch_numbers, row_indices = np.array(sent, dtype=np.int64).T
+    grouped = np.argsort(batch_numbers, kind='stable')
+    batch_numbers, row_indices = batch_numbers[grouped], row_indices[grouped]
+    pieces = []
+    for batch_number in np.unique(batch_numbers):   # one takeRows per incoming batch, in batch number order
+        parts, unsent = held[batch_number]
+        selected = row_indices[batch_numbers == batch_number]
+        pieces.append([takeRows(part, selected) for part in parts])
+        held[batch_number][1] = unsent - len(selected)
+        if held[batch_number][1] == 0:
+            del held[batch_number]
+    parts = [reduce(concatRows, part_pieces) for part_pieces in zip(*pieces)]
+    if len(pieces) == 1:
+        return tuple(parts)     # a single incoming batch was gathered in the order its rows left the buffer
+    return tuple(takeRows(part, np.argsort(grouped)) for part in parts)
 
 
 def connectTCP():   # connect to the TCP server -- there is no need to modify this function
@@ -36,115 +1191,281 @@ def connectTCP():   # connect to the TCP server -- there is no need to modify th
     return connection, address
 
 
-# separate function to stream CIFAR batches since the format is different
-def sendCIFARBatchFileToSpark(tcp_connection, input_batch_file):
+# lookup table holding the decimal text of every uint8 value, so pixels can be written as JSON without creating Python ints
+DIGITS = np.zeros((256, 3), dtype=np.uint8)
+DIGIT_MASK = np.zeros((256, 3), dtype=bool)     # which of the 3 digit slots are used by each value
+for _value in range(256):
+    _text = str(_value).encode()
+    DIGITS[_value, :len(_text)] = np.frombuffer(_text, dtype=np.uint8)
+    DIGIT_MASK[_value, :len(_text)] = True
+
+_feature_prefixes = dict()     # (feature_size, schema) -> prefix template and mask
+
+
+def featurePrefixes(feature_size, schema):
+    # text written in front of every feature value of a row, right aligned in a fixed width slot
+    key = (feature_size, schema)
+    if key not in _feature_prefixes:
+        if schema == 'features':
+            prefixes = [f'"feature{feature_index}": '.encode() for feature_index in range(feature_size)]
+            prefixes = prefixes[:1] + [b', ' + prefix for prefix in prefixes[1:]]
+        elif schema == 'columnar':  # columnar rows only need the separator between the values of the feature array
+            prefixes = [b''] + [b', '] * (feature_size - 1)
+        else:   # the schema is the shape of the nested lists a row is written as
+            prefixes = nestedPrefixes(schema)
+        width = max(len(prefix) for prefix in prefixes)
+        template = np.zeros((feature_size, width), dtype=np.uint8)
+        mask = np.zeros((feature_size, width), dtype=bool)
+        for feature_index, prefix in enumerate(prefixes):
+            if prefix:
+                template[feature_index, width-len(prefix):] = np.frombuffer(prefix, dtype=np.uint8)
+                mask[feature_index, width-len(prefix):] = True
+        _feature_prefixes[key] = (template, mask)
+    return _feature_prefixes[key]
+
+
+def nestedPrefixes(shape):
+    # every value opens a list for each index that starts over at 0, after closing the lists of those indices
+    indices = np.stack(np.unravel_index(np.arange(int(np.prod(shape))), shape), axis=1)
+    restarts = np.cumprod(indices[:, ::-1] == 0, axis=1).sum(axis=1).tolist()
+    return [b'[' * len(shape)] + [b']' * restart + b', ' + b'[' * restart for restart in restarts[1:]]
+
+
+def encodeUint8Rows(rows, schema='features'):
+    '''
+    Writes the JSON body of every row of a 2D uint8 array straight from the NumPy buffer.
+    Each row becomes the text between the braces (schema='features') or brackets (schema='columnar'),
+    or nested lists missing their closing brackets when schema is the shape of a row, like (2, 2) here:
+
+    features: "feature0": 59, "feature1": 43, ...
+    columnar: 59, 43, ...
+    (2, 2):   [[59, 43], [50, 68
+
+    Every feature gets a fixed width slot of prefix and digits, the used bytes are then picked out with one boolean mask,
+    so no Python object is created per feature.
+    '''
+    row_count, feature_size = rows.shape
+    if row_count == 0 or feature_size == 0:
+        return [b''] * row_count
+    template, template_mask = featurePrefixes(feature_size, schema)
+    width = template.shape[1]
+    slots = np.empty((row_count, feature_size, width + DIGITS.shape[1]), dtype=np.uint8)
+    slots_mask = np.empty(slots.shape, dtype=bool)
+    slots[:, :, :width] = template
+    slots_mask[:, :, :width] = template_mask
+    slots[:, :, width:] = DIGITS[rows]
+    slots_mask[:, :, width:] = DIGIT_MASK[rows]
+    body = slots[slots_mask].tobytes()
+    row_ends = np.cumsum(slots_mask.reshape(row_count, -1).sum(axis=1)).tolist()
+    return [body[row_start:row_end] for row_start, row_end in zip([0] + row_ends[:-1], row_ends)]
+
+
+def encodeCIFARBatch(image_data_batch, image_label, schema='features'):
+    '''
+    Encodes a batch of CIFAR images and labels as a newline terminated JSON payload.
+    schema='features' is byte-identical to json.dumps of the {index: {'feature0': ..., 'label': ...}} dict sent so far.
+    schema='columnar' sends one feature array per row instead:
+
+    {
+        '0': {'features': [<value>, <value>, ...], 'label': <label>},
+        ...
+    }
+    '''
+    image_data_batch = np.asarray(image_data_batch)
+    if len(image_data_batch) == 0:
+        return b'{}\n'
+    if image_data_batch.dtype != np.uint8:  # the digit table only covers uint8, fall back to plain json
+        return encodeImagePayload(image_data_batch.tolist(), image_label, schema)
+    rows = encodeUint8Rows(image_data_batch.reshape(len(image_data_batch), -1), schema)
+    if schema == 'features':
+        records = [b'"%d": {%s, "label": %s}' % (mini_batch_index, row, json.dumps(label).encode())
+                   for mini_batch_index, (row, label) in enumerate(zip(rows, image_label))]
+    else:
+        records = [b'"%d": {"features": [%s], "label": %s}' % (mini_batch_index, row, json.dumps(label).encode())
+                   for mini_batch_index, (row, label) in enumerate(zip(rows, image_label))]
+    return b'{' + b', '.join(records) + b'}\n'
+
+
+def encodeImagePayload(image_data_batch, image_label, schema='features'):
+    # reference encoder going through Python dicts, used for image arrays that are not uint8
+    payload = dict()
+    for mini_batch_index in range(len(image_data_batch)):
+        payload[mini_batch_index] = dict()
+        if schema == 'features':
+            for feature_index, feature in enumerate(image_data_batch[mini_batch_index]):  # iterate over features
+                payload[mini_batch_index][f'feature{feature_index}'] = feature
+        else:
+            payload[mini_batch_index]['features'] = image_data_batch[mini_batch_index]
+        payload[mini_batch_index]['label'] = image_label[mini_batch_index]
+    return (json.dumps(payload) + '\n').encode()
+
+
+def imageArray(images):
+    # the images of a pickle as one contiguous NumPy array, uint8 when the values fit, images of different shapes stay a list
+    try:
+        array = np.asarray(images)
+    except ValueError:
+        return images
+    if array.dtype == object or array.ndim < 2:
+        return images
+    if array.dtype.kind in 'iu' and array.dtype != np.uint8 and array.size and array.min() >= 0 and array.max() <= 255:
+        array = array.astype(np.uint8)
+    return np.ascontiguousarray(array)
+
+
+def transformImages(images, flatten=False, resize=None, quantize=None):
+    '''
+    Applies --resize, --quantize and --flatten to a whole batch of images (rows of height x width [x channels]) at once:
+    resize picks the nearest source pixel of every target pixel with a single fancy index, quantize keeps the top
+    `quantize` bits of every uint8 value and flatten reshapes every image into one row of values.
+    '''
+    if not isinstance(images, np.ndarray):
+        if flatten or resize or quantize:
+            raise ValueError("Images of different shapes can not be flattened, resized or quantized")
+        return images
+    if resize is not None:
+        height, width = resize
+        rows = np.arange(height) * images.shape[1] // height
+        columns = np.arange(width) * images.shape[2] // width
+        images = images[:, rows[:, None], columns]
+    if quantize is not None:
+        if images.dtype != np.uint8:
+            raise ValueError("--quantize only applies to uint8 images")
+        images = images >> (8 - quantize)
+    if flatten:
+        images = images.reshape(len(images), -1)
+    return images
+
+
+def encodePokemonBatch(image_data_batch, image_label, image_encoding='list', flatten=False, resize=None, quantize=None):
+    '''
+    Encodes a batch of Pokemon images and labels as a newline terminated JSON payload: {'0': {'img': ..., 'label': ...}, ...}
+    Image arrays are transformed by transformImages first, then written as nested lists (uint8 images straight from
+    the NumPy buffer, byte-identical to json.dumps of the lists) or, with image_encoding='base64', as
+    {'img': <base64 of the raw bytes>, 'shape': [...], 'dtype': 'uint8', 'label': ...}.
+    '''
+    images = transformImages(image_data_batch, flatten, resize, quantize)
+    if isinstance(images, np.ndarray) and len(images) == 0:
+        return b'{}\n'
+    if isinstance(images, np.ndarray) and image_encoding == 'base64':
+        images = np.ascontiguousarray(images)   # the resize index does not always return C order
+        header = b'"shape": %s, "dtype": "%s"' % (json.dumps(images.shape[1:]).encode(), images.dtype.name.encode())
+        records = [b'"%d": {"img": "%s", %s, "label": %s}' % (mini_batch_index, base64.b64encode(image), header,
+                                                              json.dumps(label).encode())
+                   for mini_batch_index, (image, label) in enumerate(zip(images, image_label))]
+        return b'{' + b', '.join(records) + b'}\n'
+    if isinstance(images, np.ndarray) and images.dtype == np.uint8:
+        rows = encodeUint8Rows(images.reshape(len(images), -1), images.shape[1:])
+        closing = b']' * (images.ndim - 1)
+        records = [b'"%d": {"img": %s%s, "label": %s}' % (mini_batch_index, row, closing, json.dumps(label).encode())
+                   for mini_batch_index, (row, label) in enumerate(zip(rows, image_label))]
+        return b'{' + b', '.join(records) + b'}\n'
+    # images of other dtypes or of different shapes go through Python lists
+    image_data_batch = images.tolist() if isinstance(images, np.ndarray) else images
+    payload = dict()    
+    for mini_batch_index in range(len(image_data_batch)):   
+        payload[mini_batch_index] = dict()  
+        payload[mini_batch_index]["img"] = image_data_batch[mini_batch_index]
+        # if you want to flatten out the matrix, use --flatten
+        payload[mini_batch_index]['label'] = image_label[mini_batch_index]
+    # print(payload)    # uncomment to see the payload being sent
+    # encode the payload and add a newline character (do not forget the newline in your dataset)
+    return (json.dumps(payload) + '\n').encode()
+
+
+def encodeImageFrame(image_data_batch, image_label, flatten=False, resize=None, quantize=None):
+    # transformed images as a KIND_NDARRAY frame
+    return encodeNDArrayBatch(transformImages(image_data_batch, flatten, resize, quantize), image_label)
+
+
+def encodeCSVBatch(send_data):  # encode a batch of CSV rows, see streamCSVFile for the payload shape
+    if isinstance(send_data, pd.DataFrame):
+        send_data = send_data.values.tolist()
+    payload = dict()    # create a payload
+    # iterate over the batch
+    for mini_batch_index in range(len(send_data)):
+        payload[mini_batch_index] = dict()  # create a record
+        # iterate over the features
+        for feature_index in range(len(send_data[0])):
+            # add the feature to the record
+            payload[mini_batch_index][f'feature{feature_index}'] = send_data[mini_batch_index][feature_index]
+    # print(payload)    # uncomment to see the payload being sent
+    # encode the payload and add a newline character (do not forget the newline in your dataset)
+    return (json.dumps(payload) + '\n').encode()
+
+
+def frameBatch(kind, payload):     # prefix a binary payload with the frame header read by stream_reader.py
+    return FRAME_HEADER.pack(FRAME_MAGIC, kind, len(payload)) + payload
+
+
+def encodeNDArrayBatch(image_data_batch, image_label):
+    # the raw image buffer and labels as two .npy buffers, so the receiver gets dtype and shape without any parsing
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, np.ascontiguousarray(image_data_batch), allow_pickle=False)
+    np.lib.format.write_array(buffer, np.asarray(image_label), allow_pickle=False)
+    return frameBatch(KIND_NDARRAY, buffer.getvalue())
+
+
+def encodeArrowBatch(batch_df):
+    # a CSV batch as an Arrow IPC record batch, columns are renamed feature0 ... featureN like the JSON payload
+    try:    # only imported by the first binary CSV batch, so other datasets never load pyarrow
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("pyarrow is required to stream CSV datasets with --format binary") from None
+    record_batch = pa.RecordBatch.from_pandas(
+        batch_df.set_axis([f'feature{feature_index}' for feature_index in range(batch_df.shape[1])], axis=1),
+        preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, record_batch.schema) as writer:
+        writer.write_batch(record_batch)
+    return frameBatch(KIND_ARROW, sink.getvalue().to_pybytes())
+
+
+def readCIFARFile(input_file):  # the images and labels of a CIFAR batch file
     # load the entire dataset
-    with open(f'cifar/{input_batch_file}', 'rb') as batch_file:
+    with open(input_file, 'rb') as batch_file:
         batch_data = pickle.load(batch_file, encoding='bytes')
 
-    # obtain image data and labels
-    data = batch_data[b'data']
-    data = list(map(np.ndarray.tolist, data))
-    labels = batch_data[b'labels']
-    # setting feature size to form the payload later
-    feature_size = len(data[0])
-    # iterate over batches of size batch_size
-    for image_index in tqdm(range(0, len(data)-batch_size+2, batch_size)):
-        # load batch of images
-        image_data_batch = data[image_index:image_index+batch_size]
-        image_label = labels[image_index:image_index +
-                             batch_size]        # load batch of labels
-        payload = dict()
-        for mini_batch_index in range(len(image_data_batch)):
-            payload[mini_batch_index] = dict()
-            for feature_index in range(feature_size):  # iterate over features
-                payload[mini_batch_index][f'feature{feature_index}'] = image_data_batch[mini_batch_index][feature_index]
-            payload[mini_batch_index]['label'] = image_label[mini_batch_index]
-        # print(payload)    # uncomment to see the payload being sent
-        # encode the payload and add a newline character (do not forget the newline in your dataset)
-        send_batch = (json.dumps(payload) + '\n').encode()
-        try:
-            tcp_connection.send(send_batch)  # send the payload to Spark
-        except BrokenPipeError:
-            print("Either batch size is too big for the dataset or the connection was closed")
-        except Exception as error_message:
-            print(f"Exception thrown but was handled: {error_message}")
-        time.sleep(5)
-
-
-def streamCIFARDataset(tcp_connection, dataset_type='cifar'):
-    print("Starting to stream CIFAR data")
-    CIFAR_BATCHES = [
-        'data_batch_1',
-        'data_batch_2',   # uncomment to stream the second training dataset
-        'data_batch_3',   # uncomment to stream the third training dataset
-        'data_batch_4',   # uncomment to stream the fourth training dataset
-        'data_batch_5',    # uncomment to stream the fifth training dataset
-        # 'test_batch'      # uncomment to stream the test dataset
-    ]
-    for batch in CIFAR_BATCHES:
-        sendCIFARBatchFileToSpark(tcp_connection, batch)
-        time.sleep(5)
-
-
-def sendPokemonBatchFileToSpark(tcp_connection, input_batch_file):
+    # obtain image data and labels, the images stay in their uint8 NumPy buffer
+    return batch_data[b'data'], batch_data[b'labels']
+
+
+def loadCIFARFile(input_file, encode=None):     # the loader of the cifar dataset, see DATASETS
+    shard = convertedShard(input_file)
+    data, labels = convertedImages(shard) if shard is not None else readCIFARFile(input_file)
+    encode = encode or formatEncoder(CIFAR_ENCODERS)
+    # iterate over batches of size batch_size, the payload is encoded straight from the NumPy slices
+    return batchRows(encode, (data, labels), rowOrder(input_file, (data, labels)))
+
+
+def readPokemonFile(input_file):    # the images and labels of a Pokemon pickle
     # load the entire dataset
-    with open(f'pokemon/{input_batch_file}.pickle', 'rb') as batch_file:
+    with open(input_file, 'rb') as batch_file:
         batch_data = pickle.load(batch_file)
-    
-    # obtain image data and labels
-    data = batch_data['img']
-    labels = batch_data['label']
+
+    # obtain image data and labels, the images are kept as one contiguous NumPy array instead of nested lists
+    return imageArray(batch_data['img']), batch_data['label']
+
+
+def loadPokemonFile(input_file, encode=None):   # the loader of the pokemon dataset, see DATASETS
+    shard = convertedShard(input_file)
+    data, labels = convertedImages(shard) if shard is not None else readPokemonFile(input_file)
+    encode = encode or formatEncoder(POKEMON_ENCODERS)
     # iterate over batches of size batch_size
-    for image_index in tqdm(range(0, len(data)-batch_size+2, batch_size)):
-        # load batch of images
-        image_data_batch = data[image_index:image_index+batch_size]
-        image_label = labels[image_index:image_index +
-                             batch_size]        # load batch of labels
-        payload = dict()    
-        for mini_batch_index in range(len(image_data_batch)):   
-            payload[mini_batch_index] = dict()  
-            payload[mini_batch_index]["img"] = image_data_batch[mini_batch_index]
-            # if you want to flatten out the matrix, use payload[mini_batch_index]["img"] = np.asarray(image_data_batch[mini_batch_index]).flatten().tolist()
-            payload[mini_batch_index]['label'] = image_label[mini_batch_index]
-        # print(payload)    # uncomment to see the payload being sent
-        # encode the payload and add a newline character (do not forget the newline in your dataset)
-        send_batch = (json.dumps(payload) + '\n').encode()
-        try:
-            tcp_connection.send(send_batch)  # send the payload to Spark
-        except BrokenPipeError:
-            print("Either batch size is too big for the dataset or the connection was closed")
-        except Exception as error_message:
-            print(f"Exception thrown but was handled: {error_message}")
-        time.sleep(5)
-            
-
-def streamPokemonDataset(tcp_connection, dataset_type='pokemon'):
-    print("Starting to stream Pokemon data")
-    POKEMON_BATCHES = [
-        'train_batch_1',
-        # 'train_batch_2',   # uncomment to stream the second training dataset
-        # 'train_batch_3',   # uncomment to stream the third training dataset
-        # 'train_batch_4',   # uncomment to stream the fourth training dataset
-        # 'train_batch_5',    # uncomment to stream the fifth training dataset
-        # 'test_batch'      # uncomment to stream the test dataset
-    ]
-    for batch in POKEMON_BATCHES:
-        sendPokemonBatchFileToSpark(tcp_connection, batch)
-        time.sleep(5)
-
-
-def streamDataset(tcp_connection, dataset_type):    # function to stream a dataset
-    # this is the function you need to recreate to work with custom datasets
-    # if your dataset has multiple files (train, test, etc), modify and use this function to stream your dataset
+    return batchRows(encode, (data, labels), rowOrder(input_file, (data, labels)))
+
+
+def streamDataset(tcp_connection, dataset_type):    # stream every file of a registered dataset, see DATASETS
+    dataset = getDataset(dataset_type)
     print(f"Starting to stream {dataset_type} dataset")
-    DATASETS = [    # list of files in your dataset to stream
-        "train",
-        # "test"    # uncomment to stream the test dataset
-    ]
-    for dataset in DATASETS:
-        streamCSVFile(tcp_connection, f'{dataset_type}/{dataset}.csv')
-        time.sleep(5)
+    load = partial(loadDatasetFile, dataset)
+    if shards > 1:  # load several files at once and skip the pause between them
+        tcp_connection.runFiles([(input_file, load, (input_file,)) for input_file in dataset.files],
+                                shards, shard_order)
+        return
+    for input_file in dataset.files:
+        tcp_connection.runFile(input_file, load, input_file)
+        tcp_connection.pacer.pause()
 
 
 def streamCSVFile(tcp_connection, input_file):    # stream a CSV file to Spark
@@ -176,29 +1497,204 @@ def streamCSVFile(tcp_connection, input_file):    # stream a CSV file to Spark
     }
     '''
 
-    df = pd.read_csv(input_file)  # load the entire dataset
-    values = df.values.tolist()  # obtain the values of the dataset
-    # loop through batches of size batch_size lines
-    for i in tqdm(range(0, len(values)-batch_size+2, batch_size)):
-        send_data = values[i:i+batch_size]  # load batch of rows
-        payload = dict()    # create a payload
-        # iterate over the batch
-        for mini_batch_index in range(len(send_data)):
-            payload[mini_batch_index] = dict()  # create a record
-            # iterate over the features
-            for feature_index in range(len(send_data[0])):
-                # add the feature to the record
-                payload[mini_batch_index][f'feature{feature_index}'] = send_data[mini_batch_index][feature_index]
-        # print(payload)    # uncomment to see the payload being sent
-        # encode the payload and add a newline character (do not forget the newline in your dataset)
-        send_batch = (json.dumps(payload) + '\n').encode()
+    tcp_connection.runFile(input_file, loadCSVBatches, input_file)
+
+
+def loadCSVBatches(input_file, encode=None):    # returns a generator of the batches of a CSV file and their number (None when unknown)
+    encode = encode or formatEncoder(TABLE_ENCODERS)
+    if chunked_csv:
+        rng = shuffleRNG(input_file)
+        if shuffle_rows:    # the whole file is never in memory, shuffle through a bounded buffer instead
+            return bufferShuffle(loadCSVChunks(input_file, rng, encode), rng), None
+        return loadCSVChunks(input_file, rng, encode), None
+
+    shard = convertedShard(input_file)
+    # load the entire dataset, converted tables are memory-mapped so there is nothing to parse
+    df = tableFrame(convertedTable(shard)) if shard is not None else pd.read_csv(input_file)
+    # loop through batches of size batch_size lines, every batch is a DataFrame slice (JSON batches take its values)
+    return batchRows(encode, (df,), rowOrder(input_file, (df,)))
+
+
+def loadCSVChunks(input_file, rng=None, encode=encodeCSVBatch):
+    '''
+    Yields the batches of a CSV file while only ever holding one batch in memory: pandas parses batch_size rows at a time.
+    The payload has the same shape as in streamCSVFile, but column types are inferred per chunk,
+    so a column with missing values in some chunks only may switch between int and float values.
+    A converted table is sliced instead and keeps the column types of the whole file.
+    --sample is applied to every chunk with rng, so sampled batches hold fewer than batch_size rows.
+    '''
+    shard = convertedShard(input_file)
+    for batch_df in tableChunks(convertedTable(shard)) if shard is not None else csvChunks(input_file):
+        if sample_fraction < 1:
+            batch_df = batch_df.iloc[sampleRows((batch_df,), rng)]
+        yield Batch(encode, (batch_df,))
+
+
+def csvChunks(input_file):  # DataFrames of the rows of every batch, parsed one batch at a time
+    with pd.read_csv(input_file, chunksize=batch_size) as reader:
+        for rows in batchSizes():
+            try:
+                yield reader.get_chunk(rows)
+            except StopIteration:
+                return
+
+
+def tableChunks(table):     # DataFrames of the rows of every batch of a memory-mapped Arrow table
+    start = 0
+    for rows in batchSizes():
+        if start >= table.num_rows:
+            return
+        yield tableFrame(table.slice(start, rows))
+        start += rows
+
+
+def convertedShard(input_file):
+    '''
+    The files of the shard convert.py wrote for input_file (name -> path), from the manifest of its directory under
+    --converted. None when there is no shard, or when input_file changed since it was converted.
+    '''
+    if not converted_dir:
+        return None
+    shard_dir = os.path.join(converted_dir, os.path.dirname(input_file))
+    try:
+        with open(os.path.join(shard_dir, MANIFEST_FILE)) as manifest_file:
+            shard = json.load(manifest_file)['shards'][os.path.basename(input_file)]
+    except (OSError, ValueError, KeyError):
+        return None
+    if os.path.exists(input_file):  # the source may be gone, the shard is all that is needed
+        stat = os.stat(input_file)
+        if (stat.st_size, stat.st_mtime_ns) != (shard['source_size'], shard['source_mtime_ns']):
+            print(f"{input_file} changed since it was converted, reading it instead of its shard in {shard_dir}")
+            return None
+    return {name: os.path.join(shard_dir, shard_file) for name, shard_file in shard['files'].items()}
+
+
+def convertedImages(shard):     # memory-mapped images and the labels of a converted image file
+    return np.load(shard['data'], mmap_mode='r'), np.load(shard['labels']).tolist()
+
+
+def tableFrame(table):
+    # an Arrow table as the DataFrame read_csv returns, Arrow gives None for the missing values of text columns
+    # where read_csv has NaN, which the JSON payload would send as null instead of NaN
+    df = table.to_pandas()
+    for name, column in zip(table.column_names, table.columns):
+        if column.null_count and df[name].dtype == object:
+            df[name] = df[name].where(df[name].notna(), np.nan)
+    return df
+
+
+def convertedTable(shard):  # the Arrow table of a converted CSV file, its buffers point into the memory map
+    import pyarrow as pa    # only converted CSV files need pyarrow here
+    return pa.ipc.open_file(pa.memory_map(shard['table'])).read_all()
+
+
+class LineIndex:
+    '''
+    Line offsets of a newline delimited file, read through a read-only memory map.
+    offsets[i] is the byte offset where line i starts and offsets[-1] is the file size,
+    so lines [start, stop) are the byte range offsets[start]:offsets[stop] and can be sent without copying.
+    '''
+    SCAN_SIZE = 64 * 1024 * 1024  # bytes scanned for newlines at a time while building the index
+
+    def __init__(self, input_file, cache=False):
+        self.input_file = input_file
+        self.file = open(input_file, 'rb')
+        self.stat = os.fstat(self.file.fileno())
+        # an empty file can not be memory mapped
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.stat.st_size else b''
+        self.cache_file = f'{input_file}.lineidx.npy'
+        self.offsets = self.loadCache() if cache else None
+        if self.offsets is None:
+            self.offsets = self.build()
+            if cache:
+                self.saveCache()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def build(self):
+        size = self.stat.st_size
+        starts = [np.zeros(1, dtype=np.int64)]
+        for scan_start in range(0, size, self.SCAN_SIZE):
+            chunk = np.frombuffer(self.buffer, dtype=np.uint8,
+                                  count=min(self.SCAN_SIZE, size-scan_start), offset=scan_start)
+            starts.append(np.flatnonzero(chunk == ord('\n')).astype(np.int64) + scan_start + 1)
+            del chunk   # the memory map can not be closed while NumPy still holds a view on it
+        offsets = np.concatenate(starts)
+        if offsets[-1] != size:     # the last line has no trailing newline
+            offsets = np.append(offsets, size)
+        return offsets
+
+    def loadCache(self):
+        # the sidecar holds [size, mtime_ns, offsets...] and is ignored once the file has changed
         try:
-            tcp_connection.send(send_batch)  # send the payload to Spark
-        except BrokenPipeError:  # this indicates that the message length of the payload is more than what is allowed via TCP
-            print("Either batch size is too big for the dataset or the connection was closed")
-        except Exception as error_message:
-            print(f"Exception thrown but was handled: {error_message}")
-        time.sleep(5)
+            cached = np.load(self.cache_file)
+        except (OSError, ValueError):
+            return None
+        if len(cached) < 3 or cached[0] != self.stat.st_size or cached[1] != self.stat.st_mtime_ns:
+            return None
+        return cached[2:]
+
+    def saveCache(self):
+        try:
+            np.save(self.cache_file, np.concatenate(([self.stat.st_size, self.stat.st_mtime_ns], self.offsets)))
+        except OSError as error_message:
+            print(f"Could not save the line index to {self.cache_file}: {error_message}")
+
+    def batch(self, start, stop):   # zero-copy LineBatch of lines [start, stop)
+        stop = min(stop, len(self))
+        return LineBatch(memoryview(self.buffer)[self.offsets[start]:self.offsets[stop]],
+                         self.offsets[start:stop+1] - self.offsets[start])
+
+    def take(self, row_indices):    # LineBatch holding a copy of the lines at row_indices, in that order
+        return self.batch(0, len(self)).take(row_indices)
+
+
+class LineBatch:
+    '''Consecutive lines of a file: one view on their bytes and the offsets of every line inside it.'''
+
+    def __init__(self, view, offsets):
+        self.view = view
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line(self, row_index):
+        return self.view[self.offsets[row_index]:self.offsets[row_index+1]]
+
+    def batch(self, start, stop):   # zero-copy LineBatch of lines [start, stop) of this batch
+        stop = min(stop, len(self))
+        return LineBatch(self.view[self.offsets[start]:self.offsets[stop]], self.offsets[start:stop+1] - self.offsets[start])
+
+    def __reduce__(self):   # memory maps can not be pickled, encoder processes get a copy of the bytes
+        return LineBatch, (bytes(self.view), self.offsets)
+
+    def take(self, row_indices):    # a new LineBatch holding a copy of the selected lines
+        lines = [self.line(row_index) for row_index in row_indices]
+        offsets = np.concatenate(([0], np.cumsum([len(line) for line in lines], dtype=np.int64)))
+        return LineBatch(memoryview(b''.join(lines)), offsets)
+
+
+def encodeTextBatch(line_batch):
+    # read the lines like a text mode file would (universal newlines) so the payload does not change
+    send_data = io.StringIO(str(line_batch.view, 'utf-8'), newline=None).readlines()
+    # encode the payload and add a newline character (do not forget the newline in your dataset)
+    return (json.dumps(send_data) + '\n').encode()
+
+
+def encodeTextFrame(line_batch):    # the raw bytes of the lines as a KIND_TEXT frame, header and body stay separate buffers
+    return [FRAME_HEADER.pack(FRAME_MAGIC, KIND_TEXT, len(line_batch.view)), line_batch.view]
+
+
+_line_indexes = dict()  # input_file -> LineIndex, so --endless replays reuse the index instead of re-reading the file
+
+
+def getLineIndex(input_file):
+    line_index = _line_indexes.get(input_file)
+    if line_index is None or os.stat(input_file).st_mtime_ns != line_index.stat.st_mtime_ns:
+        line_index = _line_indexes[input_file] = LineIndex(input_file, cache=line_index_cache)
+    return line_index
 
 
 def streamFile(tcp_connection, input_file):  # stream a newline delimited file to Spark
@@ -208,22 +1704,290 @@ def streamFile(tcp_connection, input_file):  # stream a newline delimited file t
     line1\n
     line2\n
     ...
+
+    Batches are cut from the memory mapped file with a LineIndex, so the file is never read into memory as a whole.
+    With --format binary the raw bytes of the batch are sent as a KIND_TEXT frame without decoding them.
     '''
-    with open(input_file, 'r') as file:
-        data = file.readlines()  # open the file and read every line
-        total_lines = len(data)
-        # loop through batches of size batch_size lines
-        for i in tqdm(range(0, total_lines-batch_size+2, batch_size)):
-            send_data = data[i:i+batch_size]    # load batch of lines
-            # encode the payload and add a newline character (do not forget the newline in your dataset)
-            send_batch = (json.dumps(send_data) + '\n').encode()
-            try:
-                tcp_connection.send(send_batch)  # send the payload to Spark
-            except BrokenPipeError:
-                print("Either batch size is too big for the dataset or the connection was closed")
-            except Exception as error_message:
-                print(f"Exception thrown but was handled: {error_message}")
-            time.sleep(5)
+    tcp_connection.runFile(input_file, loadTextBatches, input_file)
+
+
+def loadTextBatches(input_file, encode=None):   # returns a generator of the batches of a newline delimited file and their number
+    line_index = getLineIndex(input_file)
+    encode = encode or formatEncoder(TEXT_ENCODERS)
+    # loop through batches of size batch_size lines, any line can be read from the memory map so shuffling is global here too
+    return batchRows(encode, (line_index,), rowOrder(input_file, (line_index,)))
+
+
+def syntheticBatches(input_file, generate, encode):
+    '''
+    Returns a generator of generated batches and their number (None without end): generate(rng, rows) returns the
+    row aligned parts of one batch, drawn with a single vectorized call per column. The generator is seeded like
+    shuffleRNG, so the same --seed sends the same rows and a resumed run regenerates the batches it skips.
+    '''
+    rng = shuffleRNG(input_file)
+
+    def batches():
+        remaining = synthetic_rows or np.inf
+        for rows in batchSizes():
+            rows = int(min(rows, remaining))
+            if rows <= 0:
+                return
+            parts = generate(rng, rows)
+            if sample_fraction < 1:
+                row_indices = sampleRows(parts, rng)
+                parts = tuple(takeRows(part, row_indices) for part in parts)
+            yield Batch(encode, parts)
+            remaining -= rows
+
+    return batches(), len(batchBounds(synthetic_rows)) if synthetic_rows else None
+
+
+def syntheticImages(rng, rows, shape):  # uint8 images of the given shape with labels below --cardinality
+    return rng.integers(0, 256, (rows, *shape), dtype=np.uint8), rng.integers(0, cardinality, rows).tolist()
+
+
+def syntheticTable(rng, rows, categories):
+    # CSV-shaped rows: normal numeric columns, categorical columns drawn from `categories` and an integer label
+    numeric_columns, categorical_columns = synthetic_columns
+    table = pd.DataFrame(rng.normal(size=(rows, numeric_columns)),
+                         columns=[f'value{column_index}' for column_index in range(numeric_columns)])
+    codes = rng.integers(0, len(categories), (categorical_columns, rows))
+    for column_index in range(categorical_columns):
+        table[f'category{column_index}'] = categories[codes[column_index]]
+    table['label'] = rng.integers(0, cardinality, rows)
+    return (table,)
+
+
+def syntheticLines(rng, rows, words):
+    # lines of 4 to 16 words drawn from `words` (a fixed width bytes array), joined without a loop over the lines
+    line_words = rng.integers(4, 17, rows)
+    word_indices = rng.integers(0, len(words), line_words.sum())
+    tokens = np.frombuffer(words[word_indices].tobytes(), dtype=np.uint8).reshape(len(word_indices), -1)
+    separators = np.full((len(word_indices), 1), ord(' '), dtype=np.uint8)
+    separators[np.cumsum(line_words) - 1] = ord('\n')
+    buffer = np.concatenate((tokens, separators), axis=1).ravel()
+    buffer = buffer[buffer != 0]    # drop the padding of the words shorter than the widest one
+    line_sizes = np.add.reduceat(np.char.str_len(words)[word_indices] + 1, np.cumsum(line_words) - line_words)
+    return (LineBatch(memoryview(buffer.tobytes()), np.concatenate(([0], np.cumsum(line_sizes, dtype=np.int64)))),)
+
+
+def loadSyntheticCIFAR(input_file, encode=None):    # the loader of the synthetic-cifar dataset, rows shaped like CIFAR
+    return syntheticBatches(input_file, partial(syntheticImages, shape=(3072,)), encode or formatEncoder(CIFAR_ENCODERS))
+
+
+def loadSyntheticPokemon(input_file, encode=None):  # the loader of the synthetic-pokemon dataset, 32x32 RGB images
+    return syntheticBatches(input_file, partial(syntheticImages, shape=(32, 32, 3)), encode or formatEncoder(POKEMON_ENCODERS))
+
+
+def loadSyntheticTable(input_file, encode=None):    # the loader of the synthetic-csv dataset
+    categories = np.array([f'category{category_index}' for category_index in range(cardinality)], dtype=object)
+    return syntheticBatches(input_file, partial(syntheticTable, categories=categories), encode or formatEncoder(TABLE_ENCODERS))
+
+
+def loadSyntheticText(input_file, encode=None):     # the loader of the synthetic-text dataset
+    words = np.array([f'word{word_index}'.encode() for word_index in range(cardinality)])
+    return syntheticBatches(input_file, partial(syntheticLines, words=words), encode or formatEncoder(TEXT_ENCODERS))
+
+
+# the encoders of every payload type for each --format, as names resolved on first use (see resolve)
+CIFAR_ENCODERS = {'json': 'encodeCIFARBatch', 'binary': 'encodeNDArrayBatch'}
+POKEMON_ENCODERS = {'json': 'encodePokemonBatch', 'binary': 'encodeImageFrame'}
+TABLE_ENCODERS = {'json': 'encodeCSVBatch', 'binary': 'encodeArrowBatch'}
+TEXT_ENCODERS = {'json': 'encodeTextBatch', 'binary': 'encodeTextFrame'}
+
+# files: paths streamed one after the other, loader(input_file, encode) returns a generator of the batches and their number,
+# schema: what the rows hold (images, table, lines), encoders: --format -> encoder, the loader picks its own when missing
+Dataset = namedtuple('Dataset', ['files', 'loader', 'schema', 'encoders'], defaults=['custom', {}])
+
+DATASETS = {    # -f <name> streams a registered dataset, change or add datasets with --datasets instead of editing this
+    'cifar': Dataset([f'cifar/data_batch_{file_index}' for file_index in range(1, 6)],    # add 'cifar/test_batch' to stream the test dataset
+                     'loadCIFARFile', 'images', CIFAR_ENCODERS),
+    'pokemon': Dataset(['pokemon/train_batch_1.pickle'], 'loadPokemonFile', 'images', POKEMON_ENCODERS),
+    'crime': Dataset(['crime/train.csv'], 'loadCSVBatches', 'table', TABLE_ENCODERS),
+    'sentiment': Dataset(['sentiment/train.csv'], 'loadCSVBatches', 'table', TABLE_ENCODERS),
+    'spam': Dataset(['spam/train.csv'], 'loadCSVBatches', 'table', TABLE_ENCODERS),
+    # generated rows (see syntheticBatches), the file names only seed the generator so nothing needs to exist on disk
+    'synthetic-cifar': Dataset(['synthetic-cifar'], 'loadSyntheticCIFAR', 'images', CIFAR_ENCODERS),
+    'synthetic-pokemon': Dataset(['synthetic-pokemon'], 'loadSyntheticPokemon', 'images', POKEMON_ENCODERS),
+    'synthetic-csv': Dataset(['synthetic-csv'], 'loadSyntheticTable', 'table', TABLE_ENCODERS),
+    'synthetic-text': Dataset(['synthetic-text'], 'loadSyntheticText', 'lines', TEXT_ENCODERS),
+}
+
+
+def resolve(target):
+    '''
+    Returns the function named by target: a name defined in this file, or 'package.module:function'.
+    Modules are only imported when a dataset is streamed, so registering a dataset costs nothing until it is used.
+    '''
+    if not isinstance(target, str):
+        return target
+    module_name, _, name = target.rpartition(':')
+    module = importlib.import_module(module_name) if module_name else sys.modules[__name__]
+    try:
+        return getattr(module, name)
+    except AttributeError:
+        raise ValueError(f"{target!r} does not name a function") from None
+
+
+def bindEncoder(encode):
+    # bind the stream options the encoder takes as keyword arguments: schema, image_encoding, flatten, resize, quantize
+    encode = resolve(encode)
+    options = {'schema': payload_schema, 'image_encoding': image_encoding, **image_options}
+    parameters = inspect.signature(encode).parameters
+    bound = {name: value for name, value in options.items() if name in parameters}
+    return partial(encode, **bound) if bound else encode
+
+
+def formatEncoder(encoders):    # the encoder of --format out of a dataset's encoders, None when it has none
+    encode = encoders.get(wire_format)
+    return bindEncoder(encode) if encode is not None else None
+
+
+def loadDatasetFile(dataset, input_file):   # load one file of a dataset with the encoder it declares
+    return resolve(dataset.loader)(input_file, formatEncoder(dataset.encoders))
+
+
+def makeDataset(fields, base=None):
+    # a Dataset from a config entry, fields that are not given are taken from base (the dataset it replaces)
+    if isinstance(fields, Dataset):
+        return fields
+    unknown = set(fields) - set(Dataset._fields)
+    if unknown:
+        raise ValueError(f"Unknown dataset fields {sorted(unknown)}, datasets take {list(Dataset._fields)}")
+    fields = {**(base._asdict() if base is not None else {}), **fields}
+    if 'files' not in fields or 'loader' not in fields:
+        raise ValueError("A new dataset needs its files and a loader")
+    if isinstance(fields['files'], str):
+        fields['files'] = [fields['files']]
+    return Dataset(**fields)
+
+
+def loadDatasets(config_file):
+    '''
+    Registers the datasets of a JSON config file, entries of registered datasets only need the fields they change:
+
+    {
+        "cifar": {"files": ["cifar/data_batch_1", "cifar/test_batch"]},
+        "mydata": {
+            "files": ["mydata/train.csv", "mydata/test.csv"],
+            "loader": "loadCSVBatches",
+            "schema": "table",
+            "encoders": {"json": "mypackage.encoders:encodeRows", "binary": "encodeArrowBatch"}
+        }
+    }
+    '''
+    with open(config_file) as datasets_file:
+        config = json.load(datasets_file)
+    for name, fields in config.items():
+        DATASETS[name] = makeDataset(fields, DATASETS.get(name))
+
+
+def datasetSchema(name):    # schema of a registered dataset, any other path is streamed as a newline delimited file
+    dataset = getDataset(name)
+    return dataset.schema if dataset is not None else 'lines'
+
+
+def datasetColumns(name):
+    # number of values in a row of a registered dataset, the feature indices --partition-key can take, read from its
+    # first batch (None when the first file has no rows)
+    dataset = getDataset(name)
+    batches, _ = loadDatasetFile(dataset, dataset.files[0])
+    batch = next(iter(batches), None)
+    if batch is None:
+        return None
+    data = batch.parts[0]
+    if isinstance(data, pd.DataFrame):
+        return data.shape[1]
+    if isinstance(data, np.ndarray):
+        return data.reshape(len(data), -1).shape[1]
+    return np.asarray(data[0]).size
+
+
+def getDataset(name):
+    # a registered dataset, or one another package registers under the stream.datasets entry point group
+    # (an entry point loads to a Dataset or a dict of its fields), None when there is no such dataset
+    if name in DATASETS:
+        return DATASETS[name]
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name == name:    # only the requested entry point is loaded
+            DATASETS[name] = makeDataset(entry_point.load())
+            return DATASETS[name]
+    return None
+
+
+def listDatasets():     # print every registered dataset, entry points are listed without loading them
+    for name, dataset in DATASETS.items():
+        print(f"{name}: {dataset.schema}, {len(dataset.files)} file(s): {', '.join(dataset.files)}")
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name not in DATASETS:
+            print(f"{entry_point.name}: entry point {entry_point.value}")
+
+
+def parseSize(size):    # '16x16' -> (16, 16)
+    if size is None:
+        return None
+    height, _, width = size.partition('x')
+    if not height.strip().isdigit() or not width.strip().isdigit() or int(height) == 0 or int(width) == 0:
+        raise ValueError(f"--resize takes <height>x<width>, got {size!r}")
+    return int(height), int(width)
+
+
+def parseColumns(columns):   # '8,2' -> [8, 2] numeric and categorical columns of synthetic-csv, a list like parseRamp
+    numeric, _, categorical = columns.partition(',')
+    if not numeric.strip().isdigit() or not categorical.strip().isdigit():
+        raise ValueError(f"--synthetic-columns takes <numeric>,<categorical>, got {columns!r}")
+    return [int(numeric), int(categorical)]
+
+
+def parseRamp(ramp):    # '10x20,100x20' -> [[10, 20], [100, 20]], lists so the checkpoint compares equal after a JSON round trip
+    steps = []
+    for step in (ramp or '').split(','):
+        if step.strip():
+            rows, _, batches = step.partition('x')
+            if not rows.strip().isdigit() or not batches.strip().isdigit() or int(rows) == 0:
+                raise ValueError(f"--ramp steps are <rows>x<batches>, got {step!r}")
+            steps.append([int(rows), int(batches)])
+    return steps
+
+
+def configure(args):    # set the module wide settings used by the dataset functions from parsed arguments
+    global batch_size, payload_schema, wire_format, chunked_csv, line_index_cache, shards, shard_order
+    global shuffle_rows, shuffle_buffer, seed, sample_fraction, stratify_key, compression, compress_level, pacer
+    global max_batch_bytes, batch_window, ramp_steps, image_encoding, image_options
+    global synthetic_rows, cardinality, synthetic_columns, converted_dir
+    batch_size = args.batch_size
+    payload_schema = args.schema
+    wire_format = args.format
+    chunked_csv = args.chunked
+    line_index_cache = args.line_index_cache
+    shards = args.shards
+    shard_order = args.order
+    if not 0 < args.sample <= 1:
+        raise ValueError("--sample must be a fraction between 0 and 1")
+    max_batch_bytes = args.max_batch_bytes
+    image_encoding = args.image_encoding
+    image_options = {'flatten': args.flatten, 'resize': parseSize(args.resize), 'quantize': args.quantize}
+    if args.window_ms and (args.checkpoint or args.resume):
+        # checkpoints count batches, and where a time window closes a batch differs from run to run
+        raise ValueError("--window-ms can not be combined with --checkpoint or --resume")
+    batch_window = args.window_ms / 1000 if args.window_ms else None
+    ramp_steps = parseRamp(args.ramp)
+    if args.synthetic_rows < 0 or args.cardinality < 1:
+        raise ValueError("--synthetic-rows can not be negative and --cardinality must be at least 1")
+    synthetic_rows = args.synthetic_rows
+    cardinality = args.cardinality
+    synthetic_columns = parseColumns(args.synthetic_columns)
+    converted_dir = args.converted
+    shuffle_rows = args.shuffle
+    shuffle_buffer = args.shuffle_buffer
+    seed = args.seed
+    sample_fraction = args.sample
+    stratify_key = args.stratify if args.stratify in (None, 'label') else int(args.stratify)
+    if args.compress in ('lz4', 'zstd') and importlib.util.find_spec('lz4' if args.compress == 'lz4' else 'zstandard') is None:
+        raise ImportError(f"{'lz4' if args.compress == 'lz4' else 'zstandard'} is required for --compress {args.compress}")
+    compression = args.compress
+    compress_level = args.compress_level
+    pacer = Pacer(args.rate_mode, args.interval, args.rate, args.trace, args.burst)
 
 
 if __name__ == '__main__':
@@ -231,32 +1995,70 @@ if __name__ == '__main__':
     print(args)
 
     input_file = args.file
-    batch_size = args.batch_size
     endless = args.endless
+    configure(args)
+    if args.datasets or os.path.exists(DATASETS_FILE):
+        loadDatasets(args.datasets or DATASETS_FILE)
+    if args.list_datasets:
+        listDatasets()
+        sys.exit()
+
+    schema = datasetSchema(input_file)  # keys the rows of the dataset do not have are argument errors, not errors mid-stream
+    if args.distribute == 'hash' and args.clients > 1 and args.partition_key == 'label' and schema == 'table':
+        parser.error(f"{input_file} has no labels, pass a column index as --partition-key for --distribute hash")
+    if args.partition_key != 'label' and not args.partition_key.lstrip('-').isdigit():
+        parser.error(f"--partition-key takes a column index or label, got {args.partition_key!r}")
+    if args.distribute == 'hash' and args.clients > 1 and args.partition_key != 'label' and schema != 'lines':
+        partition_key = int(args.partition_key)
+        columns = datasetColumns(input_file)
+        if columns is not None and not 0 <= partition_key < columns:
+            parser.error(f"--partition-key {partition_key} is not a column of {input_file}, its rows have {columns} columns")
+    if args.stratify is not None and schema == 'lines':
+        parser.error(f"{input_file} is streamed as newline delimited lines, which have no columns to --stratify on")
+    if args.stratify == 'label' and schema == 'table':
+        parser.error(f"{input_file} has no labels, pass a column index as --stratify")
 
-    tcp_connection, _ = connectTCP()
-
-    # to stream a custom dataset, uncomment the elif block and create your own dataset streamer function (or modify the existing one)
-    if input_file == "cifar":
-        _function = streamCIFARDataset
-    elif input_file == "pokemon":
-        _function = streamPokemonDataset
-    elif input_file in ["crime", "sentiment", "spam"]:
-        _function = streamDataset
-    # elif input_file == "my dataset":
-    #     _function = streamMyDataset
+    checkpoint_file = args.checkpoint or (CHECKPOINT_FILE if args.resume else None)
+    checkpoint = Checkpoint(checkpoint_file, input_file, rowSettings(), args.resume) if checkpoint_file else None
+    metrics = Metrics() if args.metrics_port is not None else None
+    metrics_server = metrics.serve(args.metrics_port) if metrics is not None else None
+    events = EventLog(args.event_log) if args.event_log else None
+    server = None
+    if args.resume:     # keep listening, so receivers that drop can connect again
+        server = listenTCP(args.clients)
+        connections = acceptClients(args.clients, server)
+    elif args.clients > 1:
+        connections = acceptClients(args.clients)
     else:
-        _function = streamFile
+        connections = [connectTCP()[0]]
+    tcp_connection = StreamCore(connections, args.distribute, args.partition_key, args.client_queue,
+                                args.encode_workers, args.queue_depth,
+                                BatchCache(args.cache_mb * 2**20) if endless and args.cache_mb > 0 else None,
+                                checkpoint, args.ack, server, metrics, events,
+                                pacer, compression, compress_level, max_batch_bytes)
+
+    # registered datasets stream all of their files, to stream a custom dataset register it in DATASETS or with --datasets
+    # any other path is streamed as a newline delimited file
+    _function = streamDataset if getDataset(input_file) is not None else streamFile
 
-    if endless:
+    try:
         while True:
             _function(tcp_connection, input_file)
-    else:
-        _function(tcp_connection, input_file)
-
-    tcp_connection.close()
+            if checkpoint is not None:
+                checkpoint.reset()
+            if not endless:
+                break
+    except ConnectionError as error_message:    # without --resume nobody can take over the stream
+        print(f"Stopping: {error_message}")
+        sys.exit(1)
+    finally:    # also when loading or encoding raised, so the receivers are closed before the event loop
+        tcp_connection.close()
+        if events is not None:
+            events.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
 
-# Setup your own dataset streamer by following the examples above.
+# Setup your own dataset by registering its files, loader and encoders in DATASETS, a --datasets file or an entry point.
 # If you wish to stream a single newline delimited file, use streamFile()
 # If you wish to stream a CSV file, use streamCSVFile()
 # If you wish to stream any other type of file(JSON, XML, etc.), write an appropriate function to load and stream the file
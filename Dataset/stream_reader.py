@@ -0,0 +1,138 @@
+#! /usr/bin/python3
+
+import io
+import json
+import zlib
+import socket
+import struct
+import argparse
+import numpy as np
+from functools import partial
+
+# Reads the length-prefixed binary batches written by stream.py --format binary
+# Every batch is a frame made of a fixed size header followed by the payload:
+#
+#   magic (4 bytes, b'SSTR') | kind (1 byte) | payload length (8 bytes, big endian) | payload
+#
+# KIND_NDARRAY payloads are two .npy buffers back to back: the image data and the labels
+# KIND_ARROW payloads are an Arrow IPC stream holding a single record batch with columns feature0 ... featureN
+# KIND_TEXT payloads are the raw bytes of a batch of lines from a newline delimited file
+# KIND_JSON payloads are the JSON batches of stream.py --format json, only framed when they are compressed
+#
+# The low 4 bits of the kind byte are the payload kind, the high 4 bits the codec the payload was compressed with
+# (stream.py --compress), 0 for uncompressed payloads
+#
+# With stream.py --ack the receiver acknowledges every batch by sending back one newline terminated line (ACK)
+#
+# Run using python3 stream_reader.py to connect to a running stream.py and print the shape of every batch
+# Run using python3 stream_reader.py --ack to acknowledge every batch once it was decoded
+FRAME_MAGIC = b'SSTR'
+FRAME_HEADER = struct.Struct('!4sBQ')
+KIND_NDARRAY = 1
+KIND_ARROW = 2
+KIND_TEXT = 3
+KIND_JSON = 4
+CODECS = {'none': 0, 'zlib': 1, 'lz4': 2, 'zstd': 3}    # --compress name -> codec number in the kind byte
+ACK = b'\n'
+
+
+def readExactly(stream, size):  # read exactly size bytes from a file-like object, None if the stream ended first
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def readFrame(stream):
+    '''
+    Reads the next frame from a binary file-like object (for example socket.makefile('rb')).
+    Returns a (kind, payload) tuple, or None once the stream is closed.
+    '''
+    header = readExactly(stream, FRAME_HEADER.size)
+    if header is None:
+        return None
+    magic, kind, length = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise ValueError(f"Stream is out of sync, expected frame magic {FRAME_MAGIC!r} but got {magic!r}")
+    payload = readExactly(stream, length)
+    if payload is None:
+        raise EOFError(f"Stream closed in the middle of a {length} byte frame")
+    return kind, payload
+
+
+def decompressPayload(codec, payload):
+    if codec == CODECS['none']:
+        return payload
+    if codec == CODECS['zlib']:
+        return zlib.decompress(payload)
+    if codec == CODECS['lz4']:
+        import lz4.frame    # only needed for streams compressed with lz4
+        return lz4.frame.decompress(payload)
+    if codec == CODECS['zstd']:
+        import zstandard    # only needed for streams compressed with zstd
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def decodeFrame(kind, payload):
+    '''
+    Decompresses and decodes a frame payload.
+    KIND_NDARRAY returns a (data, labels) tuple of NumPy arrays.
+    KIND_ARROW returns a pyarrow.RecordBatch (call .to_pandas() for a DataFrame).
+    KIND_TEXT returns the list of lines, newline characters included.
+    KIND_JSON returns the decoded JSON batch.
+    '''
+    kind, payload = kind & 0x0F, decompressPayload(kind >> 4, payload)
+    if kind == KIND_NDARRAY:
+        buffer = io.BytesIO(payload)
+        data = np.lib.format.read_array(buffer)
+        labels = np.lib.format.read_array(buffer)
+        return data, labels
+    if kind == KIND_ARROW:
+        import pyarrow as pa    # only the CSV datasets need pyarrow
+        with pa.ipc.open_stream(payload) as reader:
+            return reader.read_next_batch()
+    if kind == KIND_TEXT:
+        return io.StringIO(payload.decode('utf-8'), newline=None).readlines()
+    if kind == KIND_JSON:
+        return json.loads(payload)
+    raise ValueError(f"Unknown frame kind {kind}")
+
+
+def iterBatches(stream, ack=None):
+    # yield every decoded batch until the stream is closed, ack() is called once the batch was handled
+    while True:
+        frame = readFrame(stream)
+        if frame is None:
+            return
+        yield decodeFrame(*frame)
+        if ack is not None:
+            ack()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Reads binary batches from stream.py --format binary or --compress')
+    parser.add_argument('--host', help='Host running stream.py', required=False,
+                        type=str, default="localhost")
+    parser.add_argument('--port', '-p', help='Port stream.py is listening on', required=False,
+                        type=int, default=6100)
+    parser.add_argument('--ack', help='Acknowledge every batch, for stream.py --ack', required=False,
+                        action='store_true')
+    args = parser.parse_args()
+
+    with socket.create_connection((args.host, args.port)) as connection:
+        ack = partial(connection.sendall, ACK) if args.ack else None
+        for batch_index, batch in enumerate(iterBatches(connection.makefile('rb'), ack)):
+            if isinstance(batch, list):
+                print(json.dumps({'batch': batch_index, 'lines': len(batch)}))
+            elif isinstance(batch, dict):
+                print(json.dumps({'batch': batch_index, 'rows': len(batch)}))
+            elif isinstance(batch, tuple):
+                print(json.dumps({'batch': batch_index, 'data': batch[0].shape, 'labels': batch[1].shape}))
+            else:
+                print(json.dumps({'batch': batch_index, 'rows': batch.num_rows, 'columns': batch.num_columns}))
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import stream
+from stream import encodeCIFARBatch, encodeImagePayload
+
+
+def cifarBatch(rows, features, seed=0):    # uint8 rows holding every digit count (0, 9, 10, 99, 100, 255) and int labels
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, 256, (rows, features), dtype=np.uint8)
+    data[0, :6] = [0, 9, 10, 99, 100, 255]
+    return data, rng.integers(0, 10, rows).tolist()
+
+
+def test_cifar_encoder_matches_json_dumps():
+    # the vectorized encoder against the json.dumps of a dict per row it replaced, for both schemas
+    for rows, features in [(1, 6), (7, 6), (3, 3072)]:
+        data, labels = cifarBatch(rows, features)
+        for schema in ['features', 'columnar']:
+            assert encodeCIFARBatch(data, labels, schema) == encodeImagePayload(data.tolist(), labels, schema)
+
+
+def test_cifar_encoder_empty_batch():
+    data = np.zeros((0, 3072), dtype=np.uint8)
+    assert encodeCIFARBatch(data, []) == encodeImagePayload([], [])
+
+
+def csvPayloads(args):  # the encoded batches of spam/train.csv, loaded the way stream.py -f spam <args> loads them
+    stream.configure(stream.parser.parse_args(['-f', 'spam'] + args))
+    batches, _ = stream.loadCSVBatches('spam/train.csv')
+    return [batch.encode(*batch.parts) for batch in batches]
+
+
+def test_converted_csv_matches_parsed_csv(tmp_path, monkeypatch):
+    # a converted shard sends the same bytes as parsing the CSV, blanks in text columns included
+    pytest.importorskip('pyarrow')
+    import convert
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('spam')
+    with open('spam/train.csv', 'w') as csv_file:
+        csv_file.write('text,category,flag,value,label\nhello,,True,1.5,0\n,ham,,,1\nbye,spam,False,2,1\n')
+    # --chunked infers the column types of every chunk on its own, so it reads the whole file as one chunk here
+    for args in [['-b', '2'], ['-b', '10', '--chunked']]:
+        parsed = csvPayloads(args + ['--converted', ''])
+        convert.convertDataset('spam', 'converted')
+        assert csvPayloads(args + ['--converted', 'converted']) == parsed
+
+
+def test_buffer_shuffle_sends_every_row_once():
+    # 23 rows arriving in batches of 4, through a 5 row buffer, sent in batches of 3
+    stream.configure(stream.parser.parse_args(['-f', 'spam', '-b', '3', '--shuffle', '--shuffle-buffer', '5']))
+    table = pd.DataFrame({'value': np.arange(23), 'text': [f'row{row_index}' for row_index in range(23)]})
+    incoming = [stream.Batch(stream.encodeCSVBatch, (table.iloc[start:start+4],)) for start in range(0, 23, 4)]
+    sent = [batch.parts[0] for batch in stream.bufferShuffle(iter(incoming), np.random.default_rng(0))]
+    assert [len(batch_df) for batch_df in sent] == [3] * 7 + [2]
+    shuffled = pd.concat(sent)
+    assert sorted(shuffled['value']) == list(range(23)) and list(shuffled['value']) != list(range(23))
+    assert (shuffled['text'] == 'row' + shuffled['value'].astype(str)).all()    # rows stay whole
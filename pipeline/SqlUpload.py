@@ -7,6 +7,7 @@ import pandas as pd
 sys.path.insert(0, r"C:\DP Waterfall Automation")
 sys.path.insert(0, r"C:\DP Waterfall Automation\packages")
 from mySQLClass import mySQLDB
+from lib import read_transformed
 
 
 # ---------- CONFIG ----------
@@ -68,7 +69,7 @@ def _read_csvs(file_list):
             print(f"[WARN] Missing file: {fname}", flush=True)
             continue
         try:
-            df = pd.read_csv(path, dtype=object, low_memory=False, na_filter=False)
+            df = read_transformed(path, dtype=object, low_memory=False, na_filter=False)
         except Exception as e:
             print(f"[ERROR] Could not read {fname}: {e}", flush=True)
             continue
@@ -6,6 +6,7 @@ import pandas as pd
 sys.path.insert(0, r"C:\DP Waterfall Automation")
 sys.path.insert(0, r"C:\DP Waterfall Automation\packages")
 from mySQLClass import mySQLDB
+from lib import TRANSFORMED_CSV_ARGS, read_transformed
 
 # ---------- CONSTANTS ----------
 SQL_UID = "ISCBI001"
@@ -53,7 +54,7 @@ def _read_csvs(file_list):
             print(f"[WARN] Missing file: {fname}")
             continue
         try:
-            df = pd.read_csv(path, low_memory=False)
+            df = read_transformed(path, low_memory=False, **TRANSFORMED_CSV_ARGS)
         except Exception as e:
             print(f"[ERROR] Could not read {fname}: {e}")
             continue
@@ -38,6 +38,8 @@ except Exception as e:
     print(f"Details: {e}", flush=True)
     sys.exit(2)
 
+from lib import TRANSFORMED_CSV_ARGS, read_transformed  # CSV extracts, from their Parquet/Feather files when runner.py wrote them
+
 # ---------- Hardcoded Config ----------
 SQL_UID = "ISCBI001"
 SQL_PWD = "$Refresh@01234567!"
@@ -295,7 +297,7 @@ def read_csv_files(file_list) -> pd.DataFrame:
             print(f"[WARN] Missing file: {fname}", flush=True)
             continue
         try:
-            df = pd.read_csv(path, low_memory=False)
+            df = read_transformed(path, low_memory=False, **TRANSFORMED_CSV_ARGS)
         except Exception as e:
             print(f"[ERROR] Could not read {fname}: {e}", flush=True)
             continue
@@ -2,16 +2,19 @@
 from __future__ import annotations
 import subprocess
 import tempfile
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import glob
+import math
 import re
 import shutil
 import time
 from zipfile import BadZipFile
 from datetime import datetime
 from dataclasses import dataclass, field
-from typing import Optional, List, Dict, Any
+from collections import defaultdict
+from typing import Optional, List, Dict, Any, Callable, Iterable, Union
 
 # ------------- Logging -------------
 def log(msg: str) -> None:
@@ -89,24 +92,37 @@ def load_mapping(mapping_path: Path, sheet_name: str) -> pd.DataFrame:
     log(f"✔ Loaded mapping: {df_map.shape[0]} rows, {df_map.shape[1]} columns")
     return df_map
 
-def read_table_auto(path: Path) -> pd.DataFrame:
+def read_table_auto(path: Path, categorical_cols: Optional[Iterable[str]] = None,
+                    usecols: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Read a CSV or Excel export with every column as str. Columns in categorical_cols that exist in the
+    file are read as pandas Categoricals instead (CSV files are categorized while they are parsed).
+    With usecols only those columns are parsed; names the file does not have are skipped, not an error.
+    """
+    categorical_cols = list(categorical_cols or [])
+    if usecols is not None:
+        wanted = set(usecols)
+        usecols = lambda c: c in wanted
     ext = path.suffix.lower()
     if ext in (".csv", ".txt"):
-        return pd.read_csv(path, dtype=str)
+        if categorical_cols:
+            return pd.read_csv(path, dtype=defaultdict(lambda: str, {c: "category" for c in categorical_cols}),
+                               usecols=usecols)
+        return pd.read_csv(path, dtype=str, usecols=usecols)
     elif ext in (".xlsx", ".xlsm"):
-        return pd.read_excel(path, dtype=str, engine="openpyxl")
+        df = pd.read_excel(path, dtype=str, engine="openpyxl", usecols=usecols)
     elif ext == ".xls":
-        return pd.read_excel(path, dtype=str)  
+        df = pd.read_excel(path, dtype=str, usecols=usecols)  
     else:
         raise ValueError(f"Unsupported file extension: {ext}")
+    return to_categorical(df, categorical_cols) if categorical_cols else df
 
 # ------------- Date utilities -------------
 def snapshot_today_first() -> str:
     return datetime.today().replace(day=1).strftime("%m/%d/%Y")
 
-def convert_attribute_row(row: pd.Series) -> Optional[str]:
-    month_year = str(row.get("Calendar[Month Year]", "")).strip()
-    month_sort = str(row.get("Calendar[Month Sort]", "")).strip()
+def _month_year_to_attribute(val: Any) -> Optional[str]:
+    month_year = str(val).strip()
     if month_year:
         for fmt in ("%b-%y", "%b %Y"):
             try:
@@ -114,6 +130,10 @@ def convert_attribute_row(row: pd.Series) -> Optional[str]:
                 return dt.strftime("%m/%d/%Y")
             except Exception:
                 continue
+    return None
+
+def _month_sort_to_attribute(val: Any) -> Optional[str]:
+    month_sort = str(val).strip()
     if month_sort and len(month_sort) == 6 and month_sort.isdigit():
         try:
             year = int(month_sort[:4])
@@ -124,6 +144,35 @@ def convert_attribute_row(row: pd.Series) -> Optional[str]:
             pass
     return None
 
+def convert_attribute_row(row: pd.Series) -> Optional[str]:
+    return (_month_year_to_attribute(row.get("Calendar[Month Year]", ""))
+            or _month_sort_to_attribute(row.get("Calendar[Month Sort]", "")))
+
+def _convert_distinct(values: pd.Series, convert) -> np.ndarray:
+    """
+    Apply `convert` once per distinct value and map the results back to every row with a take.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    converted = np.array([convert(v) for v in uniques], dtype=object)
+    return converted[codes]
+
+def convert_attribute_column(df: pd.DataFrame) -> pd.Series:
+    """
+    Vectorized convert_attribute_row for a whole frame. Calendar[Month Year] and Calendar[Month Sort]
+    only hold a few dozen distinct months, so each distinct value is parsed once and the Month Sort
+    result only fills the rows whose Month Year did not parse. Returns the same values as
+    df.apply(convert_attribute_row, axis=1), None where neither column holds a date.
+    """
+    n = len(df)
+    if "Calendar[Month Year]" in df.columns:
+        attribute = _convert_distinct(df["Calendar[Month Year]"], _month_year_to_attribute)
+    else:
+        attribute = np.full(n, None, dtype=object)
+    unparsed = pd.isna(attribute)
+    if unparsed.any() and "Calendar[Month Sort]" in df.columns:
+        attribute[unparsed] = _convert_distinct(df["Calendar[Month Sort]"][unparsed], _month_sort_to_attribute)
+    return pd.Series(attribute, index=df.index)
+
 def convert_mmYYYY_to_attribute(val: str) -> Optional[str]:
     if val is None:
         return None
@@ -146,6 +195,41 @@ def convert_mmYYYY_to_attribute(val: str) -> Optional[str]:
     return None
 
 # ------------- Column & text utilities -------------
+FINAL_COLS = ["Source", "Snapshot", "Material", "Sales Organization", "Country", "Attribute", "Value", "BU"]
+# Final columns with a handful of distinct values repeated on every row, carried as Categoricals when JobConfig.categorical
+CATEGORICAL_COLS = ["Source", "Snapshot", "Sales Organization", "Country", "Attribute", "BU"]
+
+def to_categorical(df: pd.DataFrame, cols: Iterable[str] = CATEGORICAL_COLS) -> pd.DataFrame:
+    for c in cols:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    return df
+
+def to_plain_strings(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Categorical columns back to plain object columns, for the CSV and SQL boundaries. Missing values stay missing,
+    so the written file is the same as without categorical mode.
+    """
+    cats = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if not cats:
+        return df
+    return df.astype({c: object for c in cats})
+
+def map_str_values(s: pd.Series, transform: Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """
+    transform(s.astype(str)), run on the distinct values only when s is a Categorical (the result stays categorical).
+    Missing values go through the same astype(str) as in the plain path, so both write the same file.
+    """
+    if not isinstance(s.dtype, pd.CategoricalDtype):
+        return transform(s.astype(str))
+    codes = s.cat.codes.to_numpy()
+    distinct = list(s.cat.categories)
+    if (codes == -1).any():
+        distinct.append(np.nan)  # code -1 indexes the last entry
+    mapped = transform(pd.Series(distinct, dtype=object).astype(str))
+    new_codes, uniques = pd.factorize(mapped)
+    return pd.Series(pd.Categorical.from_codes(new_codes[codes], categories=uniques), index=s.index, name=s.name)
+
 def pick_col(df: pd.DataFrame, candidates: List[str], required: bool = True) -> Optional[str]:
     for c in candidates:
         if c in df.columns:
@@ -156,7 +240,7 @@ def pick_col(df: pd.DataFrame, candidates: List[str], required: bool = True) ->
 
 def clean_country_performance(df: pd.DataFrame, country_col: str) -> None:
     if country_col in df.columns:
-        df[country_col] = df[country_col].astype(str).str.replace(" Performance", "", regex=False)
+        df[country_col] = map_str_values(df[country_col], lambda s: s.str.replace(" Performance", "", regex=False))
 
 def strip_units_to_number(s: str) -> str:
     if s is None:
@@ -183,31 +267,112 @@ class JobConfig:
     bu_const: Optional[str] = None
     bu_col: Optional[str] = None
     country_clean_performance: bool = False
+    categorical: bool = False  # carry CATEGORICAL_COLS as pandas Categoricals from read to write
+    columnar_format: Optional[str] = None  # "parquet" or "feather": also write the output next to the CSV
 
 # ------------- Mapping merge -------------
-def enrich_with_mapping(src_df: pd.DataFrame, map_df: pd.DataFrame) -> pd.DataFrame:
-    key_cols = [
-        "SIOP[Planning System]",
-        "SIOP[Sales Organization]",
-        "SIOP[Region]",
-        "SIOP[Mapped Country]",
-        "SIOP[Sub Region]",
-    ]
-    required_cols = key_cols + ["Corrected country"]
+MAPPING_KEY_COLS = [
+    "SIOP[Planning System]",
+    "SIOP[Sales Organization]",
+    "SIOP[Region]",
+    "SIOP[Mapped Country]",
+    "SIOP[Sub Region]",
+]
+
+def _combine_codes(codes: List[np.ndarray], sizes: List[int]) -> pd.Index:
+    """
+    One key per row out of its per-column codes: a mixed-radix int64 while the product of the column sizes fits
+    in int64, else a MultiIndex of the codes, so keys never alias through an overflow.
+    """
+    if math.prod(sizes) >= 2**63:
+        return pd.MultiIndex.from_arrays(codes)
+    combined = np.zeros(len(codes[0]), dtype=np.int64)
+    for col_codes, size in zip(codes, sizes):
+        combined = combined * size + col_codes
+    return pd.Index(combined)
+
+@dataclass
+class MappingIndex:
+    """
+    Key Region Mapping compiled for lookups: one hash index per key column (its distinct values) and one over
+    the combined per-column codes of every distinct key (see _combine_codes). The Corrected country values are
+    grouped by key in sheet order, key i owning corrected[starts[i]:starts[i] + counts[i]].
+    """
+    levels: List[pd.Index]
+    keys: pd.Index
+    corrected: pd.api.extensions.ExtensionArray
+    starts: np.ndarray
+    counts: np.ndarray
+    rows: int
+
+    def lookup(self, src_df: pd.DataFrame) -> np.ndarray:
+        """
+        Position in self.keys of every source row's key, -1 where the mapping has no such key.
+        """
+        codes = []
+        unmatched = np.zeros(len(src_df), dtype=bool)
+        for col, level in zip(MAPPING_KEY_COLS, self.levels):
+            src_codes, src_uniques = pd.factorize(src_df[col], use_na_sentinel=False)
+            col_codes = level.get_indexer(src_uniques)[src_codes]  # hash each distinct source value once
+            unmatched |= col_codes == -1
+            codes.append(col_codes)
+        positions = self.keys.get_indexer(_combine_codes(codes, [len(level) for level in self.levels]))
+        positions[unmatched] = -1  # a value the mapping never has, whatever key its -1 code combined to
+        return positions
+
+def compile_mapping(map_df: pd.DataFrame) -> MappingIndex:
+    """
+    Validate the mapping sheet and compile it into a MappingIndex once, to share between all mapped jobs.
+    Like the merge it replaces, missing key values match each other and a key listed more than once repeats
+    the source rows with that key, once per mapping row.
+    """
+    required_cols = MAPPING_KEY_COLS + ["Corrected country"]
     for col in required_cols:
         if col not in map_df.columns:
             raise KeyError(f"Mapping file missing column: {col}")
-    for col in key_cols:
+    codes = []
+    levels = []
+    for col in MAPPING_KEY_COLS:
+        col_codes, uniques = pd.factorize(map_df[col], use_na_sentinel=False)
+        codes.append(col_codes)
+        levels.append(pd.Index(uniques))
+    key_codes, keys = _combine_codes(codes, [len(level) for level in levels]).factorize()
+    counts = np.bincount(key_codes, minlength=len(keys))
+    starts = np.cumsum(counts) - counts
+    corrected = map_df["Corrected country"].array[np.argsort(key_codes, kind="stable")]
+    duplicates = len(map_df) - len(keys)
+    if duplicates:
+        log(f"⚠ Mapping has {duplicates} rows repeating an earlier key; source rows with those keys are repeated")
+    log(f"🗂 Compiled mapping: {len(keys)} keys from {len(map_df)} rows")
+    return MappingIndex(levels, keys, corrected, starts, counts, len(map_df))
+
+def enrich_with_mapping(src_df: pd.DataFrame, mapping: Union[MappingIndex, pd.DataFrame]) -> pd.DataFrame:
+    if not isinstance(mapping, MappingIndex):
+        mapping = compile_mapping(mapping)
+    for col in MAPPING_KEY_COLS:
         if col not in src_df.columns:
             raise KeyError(f"Source file missing column: {col}")
-    merged = src_df.merge(map_df[required_cols], on=key_cols, how="left")
-    log(f"🔗 Merge complete: {merged.shape[0]} rows")
+    positions = mapping.lookup(src_df)
+    unmatched = int((positions == -1).sum())
+    starts = np.append(mapping.starts, -1)  # position -1 (no key) takes the last entry: no Corrected country, once
+    if len(mapping.keys) == mapping.rows:  # every key once, one Corrected country per source row
+        merged = src_df.copy()
+        corrected_at = starts[positions]
+    else:  # like the merge: a source row once per mapping row with its key, in sheet order
+        repeats = np.append(mapping.counts, 1)[positions]
+        src_rows = np.repeat(np.arange(len(src_df)), repeats)
+        offsets = np.arange(len(src_rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        merged = src_df.iloc[src_rows].reset_index(drop=True)
+        corrected_at = np.where(positions[src_rows] == -1, -1, starts[positions[src_rows]] + offsets)
+    merged["Corrected country"] = pd.Series(mapping.corrected.take(corrected_at, allow_fill=True), index=merged.index)
+    log(f"🔗 Mapping lookup complete: {merged.shape[0]} rows, {unmatched} without a mapping key")
     blanks = merged["SIOP[Country]"].isna() | (merged["SIOP[Country]"].astype(str).str.strip() == "")
     merged.loc[blanks, "SIOP[Country]"] = merged.loc[blanks, "Corrected country"]
     return merged
 
 # ------------- Transform to final (generic feeds) -------------
-def transform_to_final(df: pd.DataFrame, cfg: JobConfig, mapping_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+def transform_to_final(df: pd.DataFrame, cfg: JobConfig,
+                       mapping_df: Optional[Union[MappingIndex, pd.DataFrame]] = None) -> pd.DataFrame:
     """
     Transform a raw feed to the standard final schema:
     ['Source', 'Snapshot', 'Material', 'Sales Organization', 'Country', 'Attribute', 'Value', 'BU']
@@ -236,7 +401,7 @@ def transform_to_final(df: pd.DataFrame, cfg: JobConfig, mapping_df: Optional[pd
         if snap_col not in working.columns:
             raise KeyError(f"Snapshot column '{snap_col}' required for snapshot_mode='from_file'.")
 
-    working["Attribute"] = working.apply(convert_attribute_row, axis=1)
+    working["Attribute"] = convert_attribute_column(working)
     if cfg.country_clean_performance:
         clean_country_performance(working, country_source_col)
 
@@ -284,21 +449,68 @@ def transform_to_final(df: pd.DataFrame, cfg: JobConfig, mapping_df: Optional[pd
 
     if cfg.use_mapping:
         if "BU" in working.columns:
-            working["BU"] = (
-                working["BU"].astype(str)
-                .apply(lambda s: f"BLNK-C-{s.strip()}" if s.strip() else "BLNK-C-")
+            working["BU"] = map_str_values(
+                working["BU"], lambda s: s.apply(lambda v: f"BLNK-C-{v.strip()}" if v.strip() else "BLNK-C-")
             )
         else:
             working["BU"] = "BLNK-C-()"
 
-    final_cols = ["Source", "Snapshot", "Material", "Sales Organization", "Country", "Attribute", "Value", "BU"]
-    missing = [c for c in final_cols if c not in working.columns]
+    missing = [c for c in FINAL_COLS if c not in working.columns]
     if missing:
         raise KeyError(f"Final columns missing: {missing}")
-    return working[final_cols].copy()
+    final = working[FINAL_COLS].copy()
+    return to_categorical(final) if cfg.categorical else final
+
+def source_cols(cfg: JobConfig) -> List[str]:
+    """
+    Every source column transform_to_final can read for this job, in the order it looks for them.
+    Optional ones (fallbacks, Calendar fields, Sales Org/BU/Source columns) may be absent from the file.
+    """
+    cols = ["Calendar[Month Year]", "Calendar[Month Sort]"]
+    if cfg.use_mapping:
+        cols += MAPPING_KEY_COLS + ["SIOP[Country]"]
+    else:
+        cols.append(cfg.country_from)
+    if cfg.snapshot_mode == "from_file":
+        cols.append(cfg.snapshot_col or "Snapshot")
+    cols += cfg.material_candidates + [cfg.value_col]
+    if not cfg.source_const:
+        cols += [cfg.source_col, "SIOP[Planning System]"]
+    if cfg.sales_org_mode != "blank":
+        cols.append("SIOP[Sales Organization]")
+    if not cfg.bu_const:
+        cols += [cfg.bu_col, "SIOP[ReltioBU]"]
+    return list(dict.fromkeys(c for c in cols if c))
+
+def check_source_cols(df: pd.DataFrame, cfg: JobConfig, path: Path) -> None:
+    """
+    Raise KeyError naming every column the job cannot run without that the source file does not have.
+    """
+    required = MAPPING_KEY_COLS + ["SIOP[Country]"] if cfg.use_mapping else [cfg.country_from]
+    if cfg.snapshot_mode == "from_file":
+        required.append(cfg.snapshot_col or "Snapshot")
+    required.append(cfg.value_col)
+    missing = [c for c in required if c not in df.columns]
+    if not any(c in df.columns for c in cfg.material_candidates):
+        missing.append(f"one of {cfg.material_candidates}")
+    if missing:
+        raise KeyError(f"{cfg.label}: {path.name} is missing required column(s): {missing}")
+
+def categorical_source_cols(cfg: JobConfig) -> List[str]:
+    """
+    Source columns that end up in CATEGORICAL_COLS for this job, read as Categoricals when cfg.categorical.
+    """
+    cols = ["Calendar[Month Year]", "Calendar[Month Sort]", "SIOP[Sales Organization]"]
+    cols.append(cfg.source_col or "SIOP[Planning System]")
+    if cfg.snapshot_col:
+        cols.append(cfg.snapshot_col)
+    if not cfg.use_mapping:
+        cols.append(cfg.country_from)
+    cols.append(cfg.bu_col or "SIOP[ReltioBU]")
+    return cols
 
 # ------------- SAP GERS transform -------------
-def transform_sap_gers(df: pd.DataFrame) -> pd.DataFrame:
+def transform_sap_gers(df: pd.DataFrame, categorical: bool = False) -> pd.DataFrame:
     df = df.copy()
     df.columns = [str(c).strip() for c in df.columns]
 
@@ -336,7 +548,7 @@ def transform_sap_gers(df: pd.DataFrame) -> pd.DataFrame:
         "Value": value,
         "BU": "MDS",
     })
-    return out
+    return to_categorical(out) if categorical else out
 
 # ------------- Excel export via VBScript -------------
 def export_sheet_via_vbs(src_path: str, sheet_name: str, fmt: str = "xlsx") -> Path:
@@ -416,7 +628,7 @@ def normalize_sheet_with_header_row(df_raw: pd.DataFrame) -> pd.DataFrame:
     df = df.dropna(how="all").reset_index(drop=True)
     return df.apply(lambda col: col.astype(str).str.strip())
 
-def run_job(cfg: JobConfig, mapping_df: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
+def run_job(cfg: JobConfig, mapping_df: Optional[Union[MappingIndex, pd.DataFrame]] = None) -> Dict[str, Any]:
     if not cfg.skip_ps:
         if cfg.ps_path is None:
             raise ValueError(f"Job '{cfg.label}' requires ps_path unless skip_ps=True.")
@@ -424,14 +636,16 @@ def run_job(cfg: JobConfig, mapping_df: Optional[pd.DataFrame] = None) -> Dict[s
 
     in_path = find_latest_by_pattern(cfg.input_pattern, prefer_filename_date=True)
 
-    df_src = read_table_auto(in_path)
+    df_src = read_table_auto(in_path, categorical_source_cols(cfg) if cfg.categorical else None, usecols=source_cols(cfg))
     log(f"✔ Loaded {cfg.label} data: {df_src.shape[0]} rows, {df_src.shape[1]} columns")
+    check_source_cols(df_src, cfg, in_path)
 
     df_final = transform_to_final(df_src, cfg, mapping_df=mapping_df)
 
-    cfg.output_path.parent.mkdir(parents=True, exist_ok=True)
-    df_final.to_csv(cfg.output_path, index=False, encoding="utf-8")
+    columnar_path = write_transformed(df_final, cfg.output_path, cfg.columnar_format)
     log(f"💾 {cfg.label}: Saved transformed file -> {cfg.output_path}")
+    if columnar_path is not None:
+        log(f"💾 {cfg.label}: Saved {cfg.columnar_format} file -> {columnar_path}")
 
     return {
         "label": cfg.label,
@@ -441,8 +655,85 @@ def run_job(cfg: JobConfig, mapping_df: Optional[pd.DataFrame] = None) -> Dict[s
         "rows_out": int(df_final.shape[0]),
     }
 
+# ------------- Transformed output (CSV + Parquet/Feather) -------------
+COLUMNAR_FORMATS = ("parquet", "feather")
+# read_csv arguments that read a *_Transformed.csv the way its Parquet/Feather file stores the columns: the text
+# columns as str (Material IDs keep their leading zeros), and only blank cells as missing values
+TRANSFORMED_CSV_ARGS = {
+    "dtype": {c: str for c in FINAL_COLS if c != "Value"},
+    "keep_default_na": False,
+    "na_values": [""],
+}
+
+def write_transformed(df: pd.DataFrame, output_path: Path, columnar_format: Optional[str] = None) -> Optional[Path]:
+    """
+    Write the final frame to output_path as CSV and, with columnar_format, as a .parquet/.feather file next to it.
+    The columnar file keeps the dtypes (str, Categoricals) and is written after the CSV, so it is the newer of the two.
+    """
+    if columnar_format is not None and columnar_format not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unsupported columnar_format: {columnar_format} (expected one of {COLUMNAR_FORMATS})")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    to_plain_strings(df).to_csv(output_path, index=False, encoding="utf-8")
+    if columnar_format is None:
+        return None
+    columnar_path = output_path.with_suffix(f".{columnar_format}")
+    if columnar_format == "parquet":
+        df.to_parquet(columnar_path, index=False)
+    else:
+        df.reset_index(drop=True).to_feather(columnar_path)
+    return columnar_path
+
+def find_columnar(csv_path: Path) -> Optional[Path]:
+    """
+    The .parquet/.feather file written next to csv_path, if one exists and is not older than the CSV.
+    """
+    csv_mtime = csv_path.stat().st_mtime if csv_path.exists() else float("-inf")
+    for fmt in COLUMNAR_FORMATS:
+        p = csv_path.with_suffix(f".{fmt}")
+        if p.exists() and p.stat().st_mtime >= csv_mtime:
+            return p
+    return None
+
+def read_transformed(csv_path: Path, **read_csv_kwargs) -> pd.DataFrame:
+    """
+    Read a *_Transformed.csv from its Parquet/Feather file when there is a current one, else with pd.read_csv(**read_csv_kwargs).
+    The columnar file is not parsed again: columns keep their stored dtypes (str, numbers, Categoricals), so callers
+    pass TRANSFORMED_CSV_ARGS to get the same types from the CSV. Blanks follow read_csv: NaN by default, "" with
+    na_filter=False. dtype=object gives object columns, numbers as the text the CSV holds.
+    """
+    columnar_path = find_columnar(csv_path)
+    if columnar_path is None:
+        return pd.read_csv(csv_path, **read_csv_kwargs)
+    if columnar_path.suffix == ".parquet":
+        df = pd.read_parquet(columnar_path)
+    else:
+        df = pd.read_feather(columnar_path)
+    na_filter = read_csv_kwargs.get("na_filter", True)
+    as_object = read_csv_kwargs.get("dtype") is object
+    for c in df.columns:
+        s = df[c]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            if as_object or not na_filter:
+                s = s.astype(object)
+            elif "" in s.cat.categories:
+                df[c] = s.cat.remove_categories([""])
+                continue
+            else:
+                continue
+        if pd.api.types.is_numeric_dtype(s.dtype):
+            if as_object:  # the text to_csv wrote, missing values blank like every other column
+                df[c] = s.astype(str).where(s.notna(), "" if not na_filter else np.nan)
+            else:
+                df[c] = s
+        elif na_filter:
+            df[c] = s.replace("", np.nan)
+        else:
+            df[c] = s.fillna("")
+    return df
+
 # ------------- SAP GERS runner  -------------
-def run_job_sap_gers_vbs(src_path: Path, sheet_name: str, output_path: Path, label: str = "SAP GERS") -> Dict[str, Any]:
+def run_job_sap_gers_vbs(src_path: Path, sheet_name: str, output_path: Path, label: str = "SAP GERS",
+                         categorical: bool = False, columnar_format: Optional[str] = None) -> Dict[str, Any]:
     log(f"▶ {label}: Exporting sheet '{sheet_name}' from {src_path}")
     try:
         exported = export_sheet_via_vbs(str(src_path), sheet_name, fmt="xlsx")
@@ -457,11 +748,12 @@ def run_job_sap_gers_vbs(src_path: Path, sheet_name: str, output_path: Path, lab
     df_norm = normalize_sheet_with_header_row(df_raw)
     log(f"✅ Loaded {label} normalized data: {df_norm.shape[0]} rows, {df_norm.shape[1]} columns")
 
-    df_final = transform_sap_gers(df_norm)
+    df_final = transform_sap_gers(df_norm, categorical=categorical)
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    df_final.to_csv(output_path, index=False, encoding="utf-8")
+    columnar_path = write_transformed(df_final, output_path, columnar_format)
     log(f"💾 {label}: Saved transformed file -> {output_path}")
+    if columnar_path is not None:
+        log(f"💾 {label}: Saved {columnar_format} file -> {columnar_path}")
 
     return {
         "label": label,
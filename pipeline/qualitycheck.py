@@ -10,6 +10,7 @@ import pandas as pd
 sys.path.insert(0, r"C:\DP Waterfall Automation")
 sys.path.insert(0, r"C:\DP Waterfall Automation\packages")
 from mySQLClass import mySQLDB
+from lib import TRANSFORMED_CSV_ARGS, read_transformed
 
 SQL_UID = "ISCBI001"
 SQL_PWD = "$Refresh@01234567!"
@@ -131,7 +132,7 @@ def read_csv_files(file_list) -> pd.DataFrame:
             print(f"[WARN] Missing file: {fname}", flush=True)
             continue
         try:
-            df = pd.read_csv(path, low_memory=False)
+            df = read_transformed(path, low_memory=False, **TRANSFORMED_CSV_ARGS)
         except Exception as e:
             print(f"[ERROR] Could not read {fname}: {e}", flush=True)
             continue
@@ -2,7 +2,7 @@
 import sys
 from pathlib import Path
 from lib import (
-    JobConfig, load_mapping, run_job, run_job_sap_gers_vbs, log
+    JobConfig, load_mapping, compile_mapping, run_job, run_job_sap_gers_vbs, log
 )
 
 # ---- Paths ----
@@ -16,7 +16,15 @@ PS_DIR = Path(r"C:\DP Waterfall Automation\src")
 SAPGERS_PATH = Path(r"C:\Users\TEMP\BD\Power BI Tools Datasets - S&OP and Demand Waterfall\Downloads\Monthly Latest Snapshot\FORECAST_LIVE\SAP GERS.xlsx")
 SAPGERS_SHEET = "ZANALYSIS_PATTERN_WIDE"
 
+# ---- Categorical mode: low-cardinality final columns as pandas Categoricals (see lib.CATEGORICAL_COLS) ----
+CATEGORICAL = False
+
+# ---- Columnar output: "parquet" or "feather" next to every *_Transformed.csv, read by lib.read_transformed ----
+COLUMNAR_FORMAT = None
+
 def jc(**kwargs) -> JobConfig:
+    kwargs.setdefault("categorical", CATEGORICAL)
+    kwargs.setdefault("columnar_format", COLUMNAR_FORMAT)
     return JobConfig(**kwargs)
 
 def build_jobs():
@@ -185,7 +193,7 @@ def main():
     mapping_df = None
     if any(j.use_mapping for j in jobs):
         try:
-            mapping_df = load_mapping(MAPPING_FILE, MAPPING_SHEET)
+            mapping_df = compile_mapping(load_mapping(MAPPING_FILE, MAPPING_SHEET))
         except Exception as e:
             log(f"❌ Mapping load failed: {e}")
             sys.exit(1)
@@ -209,6 +217,8 @@ def main():
             sheet_name=SAPGERS_SHEET,
             output_path=OUT_FOLDER / "SAP_GERS_Transformed.csv",
             label="SAP GERS",
+            categorical=CATEGORICAL,
+            columnar_format=COLUMNAR_FORMAT,
         )
         summaries.append(summary_gers)
         log("=== SAP GERS: Complete ===")
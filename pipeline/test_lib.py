@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import (FINAL_COLS, MAPPING_KEY_COLS, TRANSFORMED_CSV_ARGS, _combine_codes, compile_mapping,
+                 convert_attribute_column, convert_attribute_row, enrich_with_mapping, read_transformed,
+                 to_categorical, to_plain_strings, write_transformed)
+
+# ------------- Attribute derivation -------------
+def calendar_frame() -> pd.DataFrame:
+    # repeated months, NaN, blanks, padding and values neither parser takes, in both calendar columns
+    return pd.DataFrame({
+        "Calendar[Month Year]": ["Jan-24", "Jan-24", "Feb 2024", np.nan, "", "  Mar-24 ", "bogus", None, "Jan-24", "13-24"],
+        "Calendar[Month Sort]": ["202401", np.nan, "202402", "202404", "202405", "", "202413", "20240", 202406, "202407"],
+    })
+
+def test_attribute_column_matches_row_wise_apply():
+    df = calendar_frame()
+    pd.testing.assert_series_equal(convert_attribute_column(df), df.apply(convert_attribute_row, axis=1))
+
+def test_attribute_column_with_one_calendar_column():
+    for col in ["Calendar[Month Year]", "Calendar[Month Sort]"]:
+        df = calendar_frame()[[col]]
+        pd.testing.assert_series_equal(convert_attribute_column(df), df.apply(convert_attribute_row, axis=1))
+
+# ------------- Mapping lookup -------------
+def mapping_frame() -> pd.DataFrame:
+    # every key once, a key with NaN values and a key with a blank value
+    rows = [
+        ["SAP", "1000", "EMEA", "DE", "Central", "Germany"],
+        ["SAP", "2000", "EMEA", "FR", np.nan, "France"],
+        ["JDE", np.nan, "APAC", "JP", "North", "Japan"],
+        ["JDE", "3000", "APAC", "", "South", "Unassigned"],
+    ]
+    return pd.DataFrame(rows, columns=MAPPING_KEY_COLS + ["Corrected country"])
+
+def source_frame() -> pd.DataFrame:
+    rows = [
+        ["SAP", "1000", "EMEA", "DE", "Central", ""],
+        ["SAP", "2000", "EMEA", "FR", np.nan, "FR"],
+        ["JDE", np.nan, "APAC", "JP", "North", np.nan],
+        ["JDE", "3000", "APAC", "", "South", "  "],
+        ["SAP", "1000", "EMEA", "DE", "South", ""],  # every value is in the mapping, the combination is not
+        ["XYZ", "9999", "LATAM", "BR", "South", "BR"],
+        ["SAP", "1000", "EMEA", "DE", "Central", "DE"],
+    ]
+    return pd.DataFrame(rows, columns=MAPPING_KEY_COLS + ["SIOP[Country]"])
+
+def merge_reference(src_df: pd.DataFrame, map_df: pd.DataFrame) -> pd.DataFrame:
+    # the left merge enrich_with_mapping replaced
+    merged = src_df.merge(map_df[MAPPING_KEY_COLS + ["Corrected country"]], on=MAPPING_KEY_COLS, how="left")
+    blanks = merged["SIOP[Country]"].isna() | (merged["SIOP[Country]"].astype(str).str.strip() == "")
+    merged.loc[blanks, "SIOP[Country]"] = merged.loc[blanks, "Corrected country"]
+    return merged
+
+def test_mapping_lookup_matches_merge():
+    src_df, map_df = source_frame(), mapping_frame()
+    expected = merge_reference(src_df, map_df)
+    pd.testing.assert_frame_equal(enrich_with_mapping(src_df, compile_mapping(map_df)), expected)
+    pd.testing.assert_frame_equal(enrich_with_mapping(src_df, map_df), expected)
+
+def test_duplicate_mapping_keys_repeat_source_rows():
+    # a key listed three times and one listed twice: their source rows come out once per mapping row, like the merge
+    map_df = pd.concat([mapping_frame(), mapping_frame().iloc[[0, 0, 1]]], ignore_index=True)
+    map_df.loc[len(mapping_frame()):, "Corrected country"] = ["Deutschland", "Allemagne", "Frankreich"]
+    src_df = source_frame()
+    enriched = enrich_with_mapping(src_df, compile_mapping(map_df))
+    assert len(enriched) == len(src_df) + 2 * 2 + 1  # two source rows with the first key, one with the second
+    assert enriched["Corrected country"].iloc[:3].tolist() == ["Germany", "Deutschland", "Allemagne"]
+    pd.testing.assert_frame_equal(enriched, merge_reference(src_df, map_df))
+
+def test_combined_keys_do_not_alias_past_int64():
+    # in int64, 1 * 2**32 * 2**32 wraps around to the key of (0, 0, 0)
+    codes = [np.array([0, 1]), np.array([0, 0]), np.array([0, 0])]
+    assert not _combine_codes(codes, [2**32] * 3).duplicated().any()
+
+# ------------- Transformed output -------------
+def final_frame() -> pd.DataFrame:
+    # Material IDs with leading zeros, numeric-looking and blank Sales Organizations, a country spelled like a NA string
+    rows = [
+        ["SAP", "01/01/2024", "0001", "12", "NA", "02/01/2024", 1.5, "BU1"],
+        ["SAP", "01/01/2024", "0002", "", "DE", "03/01/2024", np.nan, ""],
+        ["JDE", "01/01/2024", "ABC-7", "", "", "", 0.0, "BU2"],
+    ]
+    return pd.DataFrame(rows, columns=FINAL_COLS)
+
+@pytest.mark.parametrize("columnar_format", ["parquet", "feather"])
+@pytest.mark.parametrize("categorical", [False, True])
+def test_columnar_read_matches_csv_read(tmp_path, columnar_format, categorical):
+    pytest.importorskip("pyarrow")
+    df = to_categorical(final_frame()) if categorical else final_frame()
+    csv_path = tmp_path / "Demand_Transformed.csv"
+    write_transformed(df, csv_path, columnar_format)
+    for kwargs in [TRANSFORMED_CSV_ARGS, {"dtype": object, "na_filter": False}]:
+        expected = pd.read_csv(csv_path, **kwargs)
+        pd.testing.assert_frame_equal(to_plain_strings(read_transformed(csv_path, **kwargs)), expected)